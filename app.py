@@ -1,223 +1,445 @@
 import os
-import shutil
-import sqlite3
+import hashlib
 import datetime
-from flask import Flask, render_template, request, redirect, url_for, session
+import threading
+from flask import Flask, render_template, request, redirect, url_for, session, send_file, abort
+
+import db
+import metrics
+from blobstore import link_or_copy
+from shards import ShardWriter, SAMPLES_PER_SHARD
+from thumbnails import ThumbnailCache, FORMATS, file_digest
+from db import get_counters, assign_images_to_user, IMG_FOLDER
 
 # --- CONFIGURATION ---
-DB_PATH = 'words.db'
-IMG_FOLDER = 'static/words/words_output'
+EXPORT_IMG_DIR = 'dataset/images'
+EXPORT_LABEL_DIR = 'dataset/labels'
+EXPORT_SHARD_DIR = 'dataset/shards'
+# 'background' : export incrémental par un thread après chaque annotation
+# 'sync'       : export incrémental dans la requête
+# 'manual'     : uniquement via POST /export
+EXPORT_MODE = 'background'
+# Images servies par /image/<id> : cache navigateur d'un an (les crops ne
+# changent pas), variantes réduites et réencodées pour l'annotation
+IMAGE_MAX_AGE = 365 * 24 * 3600
+THUMB_HEIGHT = 240
+THUMB_FORMAT = 'webp'
+THUMB_MAX_HEIGHT = 2048
 
 # --- INITIALISATION FLASK ---
 app = Flask(__name__)
 app.secret_key = 'supersecret'
+# Durées par requête et par phase, requêtes SQL, /metrics (Prometheus)
+metrics.init_app(app)
 
 # --- CRÉATION BASE DE DONNÉES ---
 def init_db():
     os.makedirs(IMG_FOLDER, exist_ok=True)
 
-    # Vérifie si la base de données existe déjà
-    first_time = not os.path.exists(DB_PATH)
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    if first_time:
-        # Crée la table si elle n’existe pas déjà
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS images (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                path TEXT UNIQUE,
-                text TEXT,
-                status TEXT CHECK(status IN ('pending', 'processing', 'annotated')) DEFAULT 'pending',
-                annotator TEXT,
-                assigned_at TIMESTAMP
-            )
-        """)
-
-        for filename in sorted(os.listdir(IMG_FOLDER)):
-            if filename.endswith('.png') or filename.endswith('.jpg'):
-                full_path = os.path.join(IMG_FOLDER, filename)
-                cur.execute("INSERT OR IGNORE INTO images (path, status) VALUES (?, 'pending')", (full_path,))
-
-        conn.commit()
-
-    conn.close()
-
-# --- STATISTIQUES ---
-def get_not_annotated_count():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM images WHERE status != 'annotated'")
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
-
-def get_total_annotated_count():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM images WHERE status = 'annotated'")
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
-
-def get_total_image_count():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM images")
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
-
-def get_user_processing_count(annotator):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM images WHERE status = 'processing' AND annotator = ?", (annotator,))
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
-
-def get_user_remaining_annotations(annotator):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM images WHERE status = 'processing' AND annotator = ? AND text IS NULL", (annotator,))
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
-
-# --- REMETTRE EN PENDING APRÈS 3H ---
-def reset_expired_assignments():
-    now = datetime.datetime.now()
-    expired_time = now - datetime.timedelta(hours=3)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE images
-        SET status = 'pending', annotator = NULL, assigned_at = NULL
-        WHERE status = 'processing' AND assigned_at IS NOT NULL AND assigned_at < ?
-    """, (expired_time,))
-    conn.commit()
-    conn.close()
-
-# --- ASSIGNATION D'IMAGES À UN UTILISATEUR ---
-def assign_images_to_user(annotator_name, batch_size=50):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM images WHERE status = 'processing' AND annotator = ?", (annotator_name,))
-    count = cur.fetchone()[0]
-    if count == 0:
+    db.init_schema()
+
+    # Ajoute les images du dossier qui ne sont pas encore en base
+    # (les nouvelles pages s'ajoutent aussi à chaud avec ingest.py)
+    db.insert_images({'path': os.path.join(IMG_FOLDER, filename)}
+                     for filename in sorted(os.listdir(IMG_FOLDER))
+                     if filename.endswith('.png') or filename.endswith('.jpg'))
+
+    db.release_db()
+
+# Point d'entrée WSGI (ex. gunicorn "app:create_app()")
+_initialized = False
+
+def create_app():
+    """Initialise la base et le balayage des baux une seule fois, puis renvoie l'application."""
+    global _initialized
+    if not _initialized:
+        app.secret_key = os.environ.get('SECRET_KEY', app.secret_key)
+        init_db()
+        db.start_lease_sweeper()
+        _initialized = True
+    return app
+
+# Chaque requête emprunte une connexion au pool et la rend à la fin
+@app.teardown_appcontext
+def release_db(exc):
+    db.release_db()
+
+# --- EXPORTER LE DATASET (INCRÉMENTAL) ---
+_export_lock = threading.Lock()
+
+def _export_paths(path):
+    filename = os.path.basename(path)
+    return (os.path.join(EXPORT_IMG_DIR, filename),
+            os.path.join(EXPORT_LABEL_DIR, filename.rsplit('.', 1)[0] + '.txt'))
+
+def _export_hash(path, label):
+    return hashlib.sha1(f"{path}\0{label}".encode('utf-8')).hexdigest()
+
+def export_dataset(full=False):
+    """
+    Exporte uniquement les lignes modifiées depuis le dernier export
+    (export_dirty = 1) : écrit les nouvelles annotations, réécrit celles dont
+    le contenu a changé et supprime les fichiers des lignes revenues en pending.
+    Avec full=True, toutes les lignes sont revérifiées.
+    Retourne le nombre de lignes écrites ou supprimées.
+    """
+    with metrics.phase('export'), _export_lock:
+        os.makedirs(EXPORT_IMG_DIR, exist_ok=True)
+        os.makedirs(EXPORT_LABEL_DIR, exist_ok=True)
+
+        conn = db.get_db()
+        if full:
+            with db.transaction(conn):
+                conn.execute("UPDATE images SET export_dirty = 1, exported_hash = NULL")
+        rows = conn.execute("""
+            SELECT id, path, text, status, exported_hash FROM images
+            WHERE export_dirty = 1
+        """).fetchall()
+
+        changed = 0
         now = datetime.datetime.now()
-        cur.execute("""
-            UPDATE images
-            SET status = 'processing', annotator = ?, assigned_at = ?
-            WHERE id IN (
-                SELECT id FROM images
-                WHERE status = 'pending'
-                LIMIT ?
-            )
-        """, (annotator_name, now, batch_size))
-    conn.commit()
-    conn.close()
-
-# --- EXPORTER LE DATASET ---
-def export_dataset():
-    EXPORT_IMG_DIR = 'dataset/images'
-    EXPORT_LABEL_DIR = 'dataset/labels'
-    os.makedirs(EXPORT_IMG_DIR, exist_ok=True)
-    os.makedirs(EXPORT_LABEL_DIR, exist_ok=True)
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT path, text FROM images WHERE text IS NOT NULL")
-    rows = cur.fetchall()
-    conn.close()
-
-    for path, label in rows:
-        filename = os.path.basename(path)
-        new_img_path = os.path.join(EXPORT_IMG_DIR, filename)
-        new_txt_path = os.path.join(EXPORT_LABEL_DIR, filename.rsplit('.', 1)[0] + '.txt')
-
-        shutil.copy(path, new_img_path)
-        with open(new_txt_path, 'w', encoding='utf-8') as f:
-            f.write(label.strip())
-
-    return len(rows)
+        updates = []
+        for image_id, path, text, status, exported_hash in rows:
+            img_path, txt_path = _export_paths(path)
+
+            if status == 'annotated' and text is not None:
+                label = text.strip()
+                content_hash = _export_hash(path, label)
+                if content_hash != exported_hash:
+                    # Lien physique vers l'image (blob) : pas de copie des octets
+                    try:
+                        link_or_copy(path, img_path)
+                        with open(txt_path, 'w', encoding='utf-8') as f:
+                            f.write(label)
+                    except OSError as e:
+                        # Image manquante ou illisible : seule cette ligne reste à ré-exporter
+                        app.logger.warning("Export de l'image %s impossible : %s", image_id, e)
+                        continue
+                    changed += 1
+                updates.append((content_hash, now, image_id, status, text))
+            else:
+                if exported_hash is not None:
+                    for p in (img_path, txt_path):
+                        if os.path.exists(p):
+                            os.remove(p)
+                    changed += 1
+                updates.append((None, None, image_id, status, text))
+
+        # Une ligne modifiée pendant l'export reste marquée à ré-exporter
+        with db.transaction(conn):
+            conn.executemany("""
+                UPDATE images SET export_dirty = 0, exported_hash = ?, exported_at = ?
+                WHERE id = ? AND status IS ? AND text IS ?
+            """, updates)
+        return changed
+
+def export_shards(shard_dir=None, samples_per_shard=SAMPLES_PER_SHARD, compression=None):
+    """
+    Exporte un instantané de toutes les annotations en archives tar
+    (voir shards.py) au lieu d'un fichier image + un .txt par mot : écriture
+    et copie séquentielles. Les anciennes archives du dossier sont remplacées.
+    Retourne le nombre d'échantillons écrits.
+    """
+    shard_dir = shard_dir or EXPORT_SHARD_DIR
+    with metrics.phase('export'), _export_lock:
+        rows = db.get_db().execute("""
+            SELECT path, text FROM images
+            WHERE status = 'annotated' AND text IS NOT NULL
+            ORDER BY id
+        """).fetchall()
+
+        # Paramètres validés (ValueError) avant de supprimer l'ancien export
+        with ShardWriter(shard_dir, samples_per_shard, compression) as writer:
+            for filename in os.listdir(shard_dir):
+                if filename.startswith('shard-'):
+                    os.remove(os.path.join(shard_dir, filename))
+            for path, text in rows:
+                if not os.path.exists(path):
+                    continue
+                with open(path, 'rb') as f:
+                    writer.write(os.path.splitext(os.path.basename(path))[0], f.read(), text.strip())
+        return writer.count
+
+# --- EXPORT EN ARRIÈRE-PLAN ---
+_export_event = threading.Event()
+_export_thread = None
+
+def _export_worker():
+    while True:
+        _export_event.wait()
+        _export_event.clear()
+        try:
+            export_dataset()
+        except Exception as e:
+            app.logger.exception("Export du dataset échoué : %s", e)
+        finally:
+            db.release_db()
+
+def request_export():
+    """Demande un export incrémental selon EXPORT_MODE."""
+    global _export_thread
+    if EXPORT_MODE == 'sync':
+        export_dataset()
+    elif EXPORT_MODE == 'background':
+        if _export_thread is None or not _export_thread.is_alive():
+            _export_thread = threading.Thread(target=_export_worker, name="dataset-export", daemon=True)
+            _export_thread.start()
+        _export_event.set()
 
 
 # --- PAGE D'ACCUEIL ---
 @app.route("/", methods=["GET", "POST"])
 def home():
-    reset_expired_assignments()
     if request.method == "POST":
         annotator = request.form.get("annotator", "").strip()
         session['annotator'] = annotator or "anonyme"
         assign_images_to_user(session['annotator'])
         return redirect(url_for("annotate"))
 
-    total = get_total_image_count()
-    remaining = get_not_annotated_count()
-    return render_template("home.html", remaining=remaining, total=total)
+    counters = get_counters()
+    return render_template("home.html", remaining=counters['not_annotated'], total=counters['total'])
 
 # --- PAGE D'ANNOTATION ---
 @app.route("/annotate", methods=["GET", "POST"])
 def annotate():
-    reset_expired_assignments()
     annotator = session.get("annotator", "anonyme")
 
     if request.method == "POST":
         image_id = int(request.form["image_id"])
         action = request.form["action"]
 
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-
         if action == "add":
-            word_text = request.form["text"]
-            cur.execute("""
-                UPDATE images
-                SET text = ?, status = 'annotated'
-                WHERE id = ? AND annotator = ?
-            """, (word_text, image_id, annotator))
-
-            conn.commit()
-            conn.close()
-
-            export_dataset()  
-            return redirect(url_for("annotate"))
-
-
+            db.annotate_image(image_id, annotator, request.form["text"])
+            request_export()
         elif action == "skip":
-            cur.execute("""
-                UPDATE images
-                SET status = 'pending', annotator = NULL, assigned_at = NULL
-                WHERE id = ? AND annotator = ?
-            """, (image_id, annotator))
-
-        conn.commit()
-        conn.close()
+            db.skip_image(image_id, annotator)
+
         return redirect(url_for("annotate"))
 
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id, path FROM images WHERE status = 'processing' AND annotator = ? LIMIT 1", (annotator,))
-    row = cur.fetchone()
-    conn.close()
+    row = db.get_next_assigned_image(annotator)
 
-    total = get_total_image_count()
-    assigned = get_user_processing_count(annotator)
-    remaining = get_user_remaining_annotations(annotator)
-    total_annotated = get_total_annotated_count()
+    counters = get_counters(annotator)
 
     if row:
-        image_id, image_path = row
-        return render_template("annotate.html", image_id=image_id, image_path=image_path,
-                               annotator=annotator, total=total, assigned=assigned,
-                               remaining=remaining, total_annotated=total_annotated)
+        image_id, _ = row
+        return render_template("annotate.html", image_id=image_id,
+                               image_url=url_for("image", image_id=image_id, h=THUMB_HEIGHT),
+                               annotator=annotator, total=counters['total'],
+                               assigned=counters['processing'], remaining=counters['remaining'],
+                               total_annotated=counters['annotated'])
     else:
         return "<h2>Toutes les images ont été annotées ou assignées!</h2>"
 
 
+# --- IMAGES (ETAG, CACHE, MINIATURES) ---
+_thumbnails = None
+
+def _thumbnail_cache():
+    global _thumbnails
+    if _thumbnails is None:
+        _thumbnails = ThumbnailCache()
+    return _thumbnails
+
+@app.route("/image/<int:image_id>")
+def image(image_id):
+    """
+    Crop d'une image, avec un ETag fort (hash du contenu) et un cache long.
+    ?h=<hauteur> et/ou ?fmt=webp|jpeg|png : variante réduite / réencodée,
+    gardée dans le cache disque des miniatures.
+    """
+    row = db.get_db().execute("SELECT path, content_hash FROM images WHERE id = ?", (image_id,)).fetchone()
+    if row is None or not os.path.isfile(row[0]):
+        abort(404)
+    path, digest = row
+    digest = digest or file_digest(path)
+
+    height = request.args.get("h", type=int)
+    fmt = request.args.get("fmt")
+    if height is None and fmt is None:
+        response = send_file(path, etag=digest, max_age=IMAGE_MAX_AGE, conditional=True)
+    else:
+        fmt = fmt or THUMB_FORMAT
+        if fmt not in FORMATS or (height is not None and not 0 < height <= THUMB_MAX_HEIGHT):
+            abort(400)
+        variant = _thumbnail_cache().get(path, digest, height, fmt)
+        response = send_file(variant, mimetype=FORMATS[fmt][1], etag=f"{digest}-h{height or 0}-{fmt}",
+                             max_age=IMAGE_MAX_AGE, conditional=True)
+    response.cache_control.immutable = True
+    return response
+
+# --- API JSON : PRÉCHARGEMENT ET ENVOI GROUPÉ ---
+API_MAX_ITEMS = 50
+
+@app.route("/api/next")
+def api_next():
+    """
+    Les K prochaines images de l'annotateur ({id, url}), hors `exclude`
+    (ids déjà chez le client). Réserve un nouveau lot quand il n'en a plus.
+    """
+    annotator = session.get("annotator", "anonyme")
+    k = min(max(request.args.get("k", 10, type=int), 1), API_MAX_ITEMS)
+    exclude = [int(i) for i in request.args.get("exclude", "").split(",") if i.strip().isdigit()][:500]
+
+    rows = db.get_next_assigned_images(annotator, k, exclude)
+    if not rows and assign_images_to_user(annotator):
+        rows = db.get_next_assigned_images(annotator, k, exclude)
+
+    return {"items": [{"id": image_id, "url": url_for("image", image_id=image_id, h=THUMB_HEIGHT)}
+                      for image_id, path in rows],
+            "counters": get_counters(annotator)}
+
+@app.route("/api/labels", methods=["POST"])
+def api_labels():
+    """
+    Enregistre un lot d'annotations :
+    {"labels": [{"id": 1, "text": "..."}], "skipped": [2, 3]}
+    """
+    annotator = session.get("annotator", "anonyme")
+    payload = request.get_json(silent=True) or {}
+    try:
+        labels = [(int(item["id"]), str(item["text"])) for item in payload.get("labels", [])]
+        skipped = [int(image_id) for image_id in payload.get("skipped", [])]
+    except (KeyError, TypeError, ValueError):
+        return {"error": "format attendu : {labels: [{id, text}], skipped: [id]}"}, 400
+
+    updated = db.submit_labels(annotator, labels, skipped)
+    if labels:
+        request_export()
+    return {"updated": updated, "counters": get_counters(annotator)}
+
+
+# --- RELECTURE DES LABELS ---
+REVIEW_PAGE_SIZE = 50
+
+def _review_filters(args):
+    """
+    Filtres de relecture depuis la query string : q, mode, annotator,
+    since / until (AAAA-MM-JJ, until inclus), status ('all' = tous), before.
+    Lève ValueError sur une valeur invalide.
+    """
+    def day(name, offset=0):
+        value = args.get(name, "").strip()
+        if not value:
+            return None
+        return datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time()) \
+            + datetime.timedelta(days=offset)
+
+    mode = args.get("mode", "contains")
+    if mode not in db.REVIEW_MODES:
+        raise ValueError(f"mode inconnu : {mode!r}")
+    status = args.get("status", "annotated")
+    return {
+        'query': args.get("q", "").strip() or None,
+        'mode': mode,
+        'annotator': args.get("annotator", "").strip() or None,
+        'since': day("since"),
+        'until': day("until", 1),
+        'status': None if status == "all" else status,
+        'before_id': int(args["before"]) if args.get("before") else None,
+        'limit': min(max(int(args.get("limit", REVIEW_PAGE_SIZE)), 1), API_MAX_ITEMS),
+    }
+
+def _review_page(filters):
+    """Une page de résultats ({id, url, text, ...}) et l'id de reprise de la suivante."""
+    rows = db.search_labels(**filters)
+    items = [{"id": image_id, "url": url_for("image", image_id=image_id, h=THUMB_HEIGHT),
+              "text": text, "status": status, "annotator": annotator,
+              "annotated_at": str(annotated_at) if annotated_at else None}
+             for image_id, path, text, status, annotator, annotated_at in rows]
+    following = items[-1]["id"] if len(items) == filters['limit'] else None
+    return items, following
+
+@app.route("/api/review")
+def api_review():
+    """
+    Recherche paginée des labels : ?q=&mode=contains|prefix|exact&annotator=
+    &since=&until=&status=&limit=, page suivante avec ?before=<next>.
+    """
+    try:
+        items, following = _review_page(_review_filters(request.args))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {"items": items, "next": following}
+
+@app.route("/api/review/label", methods=["POST"])
+def api_review_label():
+    """Corrige un label sur place : {"id": 1, "text": "..."}."""
+    payload = request.get_json(silent=True) or {}
+    try:
+        image_id, text = int(payload["id"]), str(payload["text"]).strip()
+    except (KeyError, TypeError, ValueError):
+        return {"error": "format attendu : {id, text}"}, 400
+    if not text:
+        return {"error": "label vide"}, 400
+    if not db.correct_label(image_id, text):
+        return {"error": "image inconnue ou non annotée"}, 404
+    request_export()
+    return {"updated": 1}
+
+@app.route("/api/review/reopen", methods=["POST"])
+def api_review_reopen():
+    """
+    Rouvre des images pour une nouvelle saisie : {"ids": [1, 2], "assign": true}
+    les assigne à l'annotateur courant, sinon elles retournent dans la file.
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        ids = [int(image_id) for image_id in payload.get("ids", [])][:API_MAX_ITEMS * 10]
+    except (TypeError, ValueError):
+        return {"error": "format attendu : {ids: [id], assign: bool}"}, 400
+    annotator = session.get("annotator", "anonyme") if payload.get("assign") else None
+    reopened = db.reopen_images(ids, annotator)
+    if reopened:
+        request_export()
+    return {"reopened": reopened}
+
+@app.route("/review", methods=["GET", "POST"])
+def review():
+    if request.method == "POST":
+        action = request.form.get("action")
+        try:
+            corrections = [(int(key[5:]), text.strip()) for key, text in request.form.items()
+                           if key.startswith("text_") and text.strip()
+                           and text != request.form.get("old_" + key[5:])]
+            ids = [int(image_id) for image_id in request.form.getlist("selected")]
+        except ValueError:
+            return "<h2>Identifiant d'image invalide</h2>", 400
+
+        if action == "save":
+            changed = sum(db.correct_label(image_id, text) for image_id, text in corrections)
+            if changed:
+                request_export()
+        elif action in ("reopen", "reassign"):
+            annotator = session.get("annotator", "anonyme") if action == "reassign" else None
+            if db.reopen_images(ids, annotator):
+                request_export()
+        return redirect(url_for("review", **request.args))
+
+    try:
+        filters = _review_filters(request.args)
+    except ValueError as e:
+        return f"<h2>Filtre invalide : {e}</h2>", 400
+    items, following = _review_page(filters)
+    return render_template("review.html", items=items, following=following,
+                           args=request.args, modes=db.REVIEW_MODES)
+
+
+# --- EXPORT À LA DEMANDE ---
+@app.route("/export", methods=["POST"])
+def export():
+    # ?format=shards : archives tar (?compression=gz|bz2|xz, ?per_shard=N)
+    if request.args.get("format") == "shards":
+        try:
+            written = export_shards(compression=request.args.get("compression") or None,
+                                    samples_per_shard=int(request.args.get("per_shard", SAMPLES_PER_SHARD)))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        return {"written": written}
+    full = request.args.get("full") == "1"
+    changed = export_dataset(full=full)
+    return {"changed": changed}
+
+
 # --- LANCEMENT --- 
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True)
+    create_app().run(debug=True)
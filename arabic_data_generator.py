@@ -1,14 +1,113 @@
 import os
+import io
+import time
 import random
 import string
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
+import cv2
 from pathlib import Path
 import arabic_reshaper
 from bidi.algorithm import get_display
+from fontTools.ttLib import TTFont
+from imagestobinary import BinaryDatasetWriter, encode_images, is_valid_label
+from blobstore import BlobStore
+from shards import ShardWriter, SAMPLES_PER_SHARD
+
+# Words come from small prefix/root/suffix vocabularies: each one is shaped
+# and measured once, then reused for drawing, centering and labels
+SHAPE_CACHE_SIZE = 65536
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def shape_text(text):
+    """Arabic text as it is drawn: reshaped (contextual forms), in visual (RTL) order"""
+    try:
+        return get_display(arabic_reshaper.reshape(text))
+    except Exception:
+        # Fallback if reshaping fails
+        return text
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def text_bbox(font, text):
+    """Bounding box of `text` drawn with `font` at the origin"""
+    return font.getbbox(text)
+
+RENDER_ENGINES = ('pil', 'atlas')
+
+def presentation_forms(letters):
+    """Every contextual form (isolated, initial, medial, final) of `letters`,
+    lam-alef ligatures included, as the presentation characters shape_text emits"""
+    forms = set()
+    for letter in letters:
+        for context in (letter, letter + 'ب', 'ب' + letter + 'ب', 'ب' + letter,
+                        'ل' + letter, 'بل' + letter):
+            forms.update(arabic_reshaper.reshape(context))
+    return forms
+
+def blit_max(dst, src, x, y):
+    """Draw coverage `src` into `dst` at (x, y), keeping the darker ink, clipped to `dst`"""
+    h, w = dst.shape
+    sh, sw = src.shape
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sw, w), min(y + sh, h)
+    if x0 < x1 and y0 < y1:
+        region = dst[y0:y1, x0:x1]
+        np.maximum(region, src[y0 - y:y1 - y, x0 - x:x1 - x], out=region)
+
+class GlyphAtlas:
+    """Glyph coverage masks of one font at one size, rendered once
+    
+    Each character maps to (mask, left, top, advance): the mask cropped to
+    its ink, placed at (left, top) from the pen position on the baseline.
+    Words are composed from these masks instead of being drawn by PIL.
+    """
+    
+    def __init__(self, font, chars):
+        self.glyphs = {}
+        for char in chars:
+            left, top, right, bottom = font.getbbox(char, anchor='ls')
+            mask = Image.new('L', (max(right - left, 0), max(bottom - top, 0)), 0)
+            if mask.width and mask.height:
+                ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255, anchor='ls')
+            self.glyphs[char] = (np.asarray(mask), left, top, font.getlength(char))
+    
+    def supports(self, text):
+        return all(char in self.glyphs for char in text)
+    
+    def compose(self, text, rng, jitter=1):
+        """Coverage mask of shaped `text` (visual order), cropped to its ink
+        
+        Each glyph gets its own offset (up to `jitter` px, never pulled away
+        from its neighbor so joins stay connected) and ink strength.
+        `rng`: the random module or a random.Random.
+        """
+        placed = []
+        pen = 0.0
+        for char in text:
+            mask, left, top, advance = self.glyphs[char]
+            if mask.size:
+                placed.append((mask, round(pen) + left + rng.randint(-jitter, 0),
+                               top + rng.randint(-jitter, jitter), rng.randint(216, 255)))
+            pen += advance
+        if not placed:
+            return np.zeros((1, 1), np.uint8)
+        
+        x0 = min(x for _, x, _, _ in placed)
+        y0 = min(y for _, _, y, _ in placed)
+        x1 = max(x + mask.shape[1] for mask, x, _, _ in placed)
+        y1 = max(y + mask.shape[0] for mask, _, y, _ in placed)
+        strip = np.zeros((y1 - y0, x1 - x0), np.uint8)
+        for mask, x, y, strength in placed:
+            if strength < 255:
+                mask = (mask.astype(np.uint16) * strength // 255).astype(np.uint8)
+            blit_max(strip, mask, x - x0, y - y0)
+        return strip
 
 class ArabicOCRWordGenerator:
-    def __init__(self, output_dir="arabic_ocr_data"):
+    def __init__(self, output_dir="arabic_ocr_data", font_dir=None, store_dir=None,
+                 glyph_source=None, glyph_ratio=0.5, engine='pil'):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         
@@ -18,6 +117,22 @@ class ArabicOCRWordGenerator:
         self.images_dir.mkdir(exist_ok=True)
         self.labels_dir.mkdir(exist_ok=True)
         
+        # Optional content-addressed store: images are written once as blobs
+        # and hardlinked into images_dir (identical images share storage)
+        self.store = BlobStore(store_dir) if store_dir else None
+        
+        # Optional real handwriting (handwritten_chars.HandwrittenGlyphs): a
+        # share `glyph_ratio` of the words it can spell are composed from
+        # scanned handwritten letters instead of a font
+        self.glyph_source = glyph_source
+        self.glyph_ratio = glyph_ratio
+        
+        # Font rendering engine: 'pil' draws every word with ImageDraw.text,
+        # 'atlas' composes it from glyphs pre-rendered per font and size
+        if engine not in RENDER_ENGINES:
+            raise ValueError(f"unknown engine {engine!r}, expected one of {RENDER_ENGINES}")
+        self.engine = engine
+        
         # Arabic letters (without diacritics for simplicity)
         self.arabic_letters = [
             'ا', 'ب', 'ت', 'ث', 'ج', 'ح', 'خ', 'د', 'ذ', 'ر', 'ز', 'س', 'ش', 'ص', 'ض', 
@@ -34,7 +149,7 @@ class ArabicOCRWordGenerator:
         # Numbers in Arabic
         self.arabic_numbers = ['٠', '١', '٢', '٣', '٤', '٥', '٦', '٧', '٨', '٩','0','1','2','3','4','5','6','7','8','9']
         
-        # Try to load an Arabic font (you might need to adjust the path)
+        # Candidate Arabic fonts (you might need to adjust the path)
         self.arabic_fonts = [
             "/System/Library/Fonts/Arial Unicode.ttf",  # macOS
             "C:/Windows/Fonts/arial.ttf",  # Windows
@@ -42,20 +157,79 @@ class ArabicOCRWordGenerator:
             "NotoSansArabic-Regular.ttf",  # If you have Noto fonts
             "amiri-regular.ttf"  # If you have Amiri font
         ]
+        # A directory of Arabic fonts: one of them is sampled per image
+        if font_dir is not None:
+            self.arabic_fonts = sorted(str(p) for p in Path(font_dir).iterdir()
+                                       if p.suffix.lower() in ('.ttf', '.otf'))
+        
+        # Resolve usable fonts once; loaded faces are cached by (path, size)
+        self.font_paths = self.resolve_arabic_fonts(self.arabic_fonts)
+        if not self.font_paths:
+            raise RuntimeError(
+                "No usable Arabic font found. Install one of "
+                f"{self.arabic_fonts} or pass font_dir= a folder of Arabic .ttf/.otf fonts.")
+        self._font_cache = {}
+        self._atlas_cache = {}
+        
+        # Noise generator (reseeded per chunk by seed_chunk)
+        self.rng = np.random.default_rng()
+        # 3x3 kernel: stroke thickening equivalent to the 8 offset passes
+        self.stroke_kernel = np.ones((3, 3), np.uint8)
+    
+    def __getstate__(self):
+        # Loaded faces and atlases are not shipped to worker processes, each one rebuilds its caches
+        state = self.__dict__.copy()
+        state['_font_cache'] = {}
+        state['_atlas_cache'] = {}
+        return state
+    
+    def resolve_arabic_fonts(self, candidates):
+        """Keep the fonts that exist and cover every letter and digit we draw
+        
+        Candidates are resolved the way ImageFont.truetype finds them, so bare
+        names ("amiri-regular.ttf") are looked up in the system font folders.
+        """
+        probe = ' '.join(self.arabic_letters)
+        required = set(self.arabic_letters + self.arabic_numbers)
+        required |= set(arabic_reshaper.reshape(probe)) - {' '}
         
-    def get_arabic_font(self, size):
-        """Try to load an Arabic-compatible font"""
-        for font_path in self.arabic_fonts:
+        usable = []
+        for candidate in candidates:
             try:
-                return ImageFont.truetype(font_path, size)
-            except:
+                font_path = ImageFont.truetype(candidate, 12).path
+                cmap = TTFont(font_path, lazy=True).getBestCmap() or {}
+            except Exception:
                 continue
+            if font_path not in usable and all(ord(c) in cmap for c in required):
+                usable.append(font_path)
+        return usable
+    
+    def get_arabic_font(self, size, font_path=None):
+        """Return a cached Arabic font, sampled from the usable fonts if no path is given"""
+        if font_path is None:
+            if len(self.font_paths) == 1:
+                font_path = self.font_paths[0]
+            else:
+                font_path = random.choice(self.font_paths)
         
-        # Fallback to default font
-        try:
-            return ImageFont.load_default()
-        except:
-            return None
+        key = (font_path, size)
+        font = self._font_cache.get(key)
+        if font is None:
+            font = ImageFont.truetype(font_path, size)
+            self._font_cache[key] = font
+        return font
+    
+    def get_glyph_atlas(self, font):
+        """Glyph atlas of a loaded font, built on first use: every form of the
+        letters the word vocabularies use, and the digits"""
+        key = (font.path, font.size)
+        atlas = self._atlas_cache.get(key)
+        if atlas is None:
+            letters = set(self.arabic_letters).union(
+                *self.common_prefixes, *self.common_roots, *self.common_suffixes)
+            atlas = GlyphAtlas(font, presentation_forms(sorted(letters)) | set(self.arabic_numbers))
+            self._atlas_cache[key] = atlas
+        return atlas
     
     def generate_synthetic_arabic_word(self, min_length=2, max_length=8):
         """Generate a synthetic Arabic word"""
@@ -97,19 +271,13 @@ class ArabicOCRWordGenerator:
         
         return word
     
-    def add_handwriting_variations_arabic(self, draw, text, x, y, font, base_color):
-        """Add handwriting-like variations to Arabic text"""
-        # Arabic text needs proper shaping and bidi handling
-        try:
-            reshaped_text = arabic_reshaper.reshape(text)
-            display_text = get_display(reshaped_text)
-        except:
-            # Fallback if arabic_reshaper is not available
-            display_text = text
+    def add_handwriting_variations_arabic(self, text, x, y, font, base_color, size):
+        """Render Arabic text once with handwriting-like variations
         
-        # Get text dimensions
-        bbox = draw.textbbox((0, 0), display_text, font=font)
-        text_width = bbox[2] - bbox[0]
+        Returns the text coverage mask (uint8, H x W) and the ink color.
+        """
+        # Arabic text needs proper shaping and bidi handling
+        display_text = shape_text(text)
         
         # Add overall text rotation and position variation
         overall_y_offset = random.randint(-5, 5)
@@ -119,124 +287,382 @@ class ArabicOCRWordGenerator:
         color_var = random.randint(-40, 40)
         varied_color = max(20, min(200, base_color + color_var))
         
-        # Draw the text with slight variations
-        final_x = x + overall_x_offset
-        final_y = y + overall_y_offset
-        
-        # Add slight blur effect for handwriting
-        for offset in [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]:
-            blur_color = max(0, varied_color - 50)
-            draw.text((final_x + offset[0], final_y + offset[1]), 
-                     display_text, font=font, fill=(blur_color, blur_color, blur_color))
+        # Draw the glyphs a single time into a coverage mask
+        mask = Image.new('L', size, 0)
+        ImageDraw.Draw(mask).text((x + overall_x_offset, y + overall_y_offset),
+                                  display_text, font=font, fill=255)
         
-        # Main text
-        draw.text((final_x, final_y), display_text, font=font, 
-                 fill=(varied_color, varied_color, varied_color))
+        return np.asarray(mask), varied_color
+    
+    def compose_strokes(self, masks, bg_colors, ink_colors):
+        """Composite a batch of text masks (B, H, W) onto their backgrounds
         
-        return text_width
+        The mask is dilated with a 3x3 kernel for the darker blurred outline,
+        then the main stroke is drawn on top, all images at once.
+        """
+        # Dilate the whole batch in one call: images stacked vertically,
+        # separated by an empty row so strokes don't bleed between them
+        b, h, w = masks.shape
+        stacked = np.zeros((b, h + 1, w), np.uint8)
+        stacked[:, :h] = masks
+        halos = cv2.dilate(stacked.reshape(b * (h + 1), w), self.stroke_kernel)
+        halos = halos.reshape(b, h + 1, w)[:, :h]
+        
+        bg = np.asarray(bg_colors, np.float32)[:, None, None]
+        ink = np.asarray(ink_colors, np.float32)[:, None, None]
+        blur = np.maximum(ink - 50, 0)
+        
+        out = bg + (blur - bg) * (halos * np.float32(1 / 255))
+        out += (ink - out) * (masks * np.float32(1 / 255))
+        return out.round().astype(np.uint8)
     
-    def add_noise_and_effects(self, img):
-        """Add realistic noise and effects to simulate paper and scanning artifacts"""
-        img_array = np.array(img)
+    def add_noise_and_effects(self, batch):
+        """Add realistic noise and effects to simulate paper and scanning artifacts
         
-        # Add paper texture (slight random noise)
-        noise = np.random.randint(-15, 15, img_array.shape)
-        img_array = np.clip(img_array + noise, 0, 255)
+        Works in place on a uint8 batch (B, H, W) and returns it.
+        """
+        b, h, w = batch.shape
         
-        # Add occasional ink blots or smudges
-        if random.random() < 0.3:
+        # Add paper texture (slight random noise)
+        noisy = batch.astype(np.int16)
+        noisy += self.rng.integers(-15, 15, batch.shape, dtype=np.int16)
+        np.clip(noisy, 0, 255, out=noisy)
+        batch[...] = noisy
+        
+        # Add occasional ink blots or smudges (indexing by position: a
+        # boolean mask would hand out copies and drop the writes)
+        for k in np.flatnonzero(self.rng.random(b) < 0.3):
+            img = batch[k]
             # Random small dark spots
-            for _ in range(random.randint(1, 3)):
-                x = random.randint(0, img_array.shape[1]-1)
-                y = random.randint(0, img_array.shape[0]-1)
-                size = random.randint(1, 3)
-                img_array[max(0, y-size):min(img_array.shape[0], y+size),
-                         max(0, x-size):min(img_array.shape[1], x+size)] = random.randint(0, 100)
+            for _ in range(self.rng.integers(1, 4)):
+                x = self.rng.integers(0, w)
+                y = self.rng.integers(0, h)
+                size = self.rng.integers(1, 4)
+                img[max(0, y-size):min(h, y+size),
+                    max(0, x-size):min(w, x+size)] = self.rng.integers(0, 101)
+        
+        return batch
+    
+    def render_handwritten_word(self, word, width=300, height=60):
+        """Compose a word from real handwritten letters (isolated forms), right to left"""
+        # Off-white background
+        bg_color = random.randint(240, 255)
+        glyph_h = random.randint(28, 44)
+        
+        # Letters cropped to their ink and scaled to a common height
+        glyphs = []
+        for letter in word:
+            glyph = self.glyph_source.sample(letter, random)
+            cols = np.flatnonzero(glyph.max(axis=0))
+            if len(cols):
+                glyph = glyph[:, cols[0]:cols[-1] + 1]
+            glyph_w = max(1, round(glyph.shape[1] * glyph_h / glyph.shape[0]))
+            glyphs.append(cv2.resize(glyph, (glyph_w, glyph_h), interpolation=cv2.INTER_AREA))
+        
+        # Irregular spacing, letters may touch or overlap slightly
+        gaps = [0] + [max(random.randint(-2, 4), 1 - g.shape[1]) for g in glyphs[1:]]
+        strip_w = sum(g.shape[1] for g in glyphs) + sum(gaps)
+        strip = np.zeros((glyph_h, strip_w), np.uint8)
+        x = strip_w
+        for glyph, gap in zip(glyphs, gaps):
+            x -= gap + glyph.shape[1]
+            np.maximum(strip[:, x:x + glyph.shape[1]], glyph, out=strip[:, x:x + glyph.shape[1]])
+        
+        # Shrink long words to fit
+        if strip_w > width - 10:
+            new_h = max(1, glyph_h * (width - 10) // strip_w)
+            strip = cv2.resize(strip, (width - 10, new_h), interpolation=cv2.INTER_AREA)
+        
+        # Center with the same jitter as font rendering
+        sh, sw = strip.shape
+        x = min(max((width - sw) // 2 + random.randint(-10, 10), 0), width - sw)
+        y = min(max((height - sh) // 2 + random.randint(-5, 5), 0), height - sh)
+        mask = np.zeros((height, width), np.uint8)
+        mask[y:y + sh, x:x + sw] = strip
+        
+        # Ink color, varied like add_handwriting_variations_arabic
+        ink_color = max(20, min(200, random.randint(0, 60) + random.randint(-40, 40)))
+        return mask, bg_color, ink_color, True
+    
+    def render_atlas_word(self, word, atlas, bg_color, width=300, height=60):
+        """Compose the text mask of a word from a glyph atlas, with per-glyph jitter"""
+        strip = atlas.compose(shape_text(word), random)
+        
+        # Center the ink, with the same position and color variations as
+        # add_handwriting_variations_arabic
+        sh, sw = strip.shape
+        x = (width - sw) // 2 + random.randint(-10, 10) + random.randint(-3, 3)
+        y = (height - sh) // 2 + random.randint(-5, 5) + random.randint(-5, 5)
+        mask = np.zeros((height, width), np.uint8)
+        blit_max(mask, strip, x, y)
+        
+        ink_color = max(20, min(200, random.randint(0, 60) + random.randint(-40, 40)))
+        return mask, bg_color, ink_color, False
+    
+    def render_word(self, word, width=300, height=60):
+        """Render the text mask of a word; returns (mask, background, ink color, isolated)
         
-        # Slight blur to simulate handwriting
-        img = Image.fromarray(img_array.astype(np.uint8))
+        `isolated` is True when the word was composed from handwritten isolated
+        letters (see label_text).
+        """
+        if (self.glyph_source is not None and self.glyph_source.supports(word)
+                and random.random() < self.glyph_ratio):
+            return self.render_handwritten_word(word, width, height)
         
-        return img
-    
-    def generate_word_image(self, word, width=300, height=60):
-        """Generate a handwritten-style image of an Arabic word"""
-        # Create image with off-white background
+        # Off-white background
         bg_color = random.randint(240, 255)
-        img = Image.new('RGB', (width, height), color=(bg_color, bg_color, bg_color))
-        draw = ImageDraw.Draw(img)
         
         # Get font
         font_size = random.randint(20, 35)
         font = self.get_arabic_font(font_size)
         
-        if font is None:
-            print("Warning: Could not load Arabic font. Text might not display correctly.")
-            font = ImageFont.load_default()
+        if self.engine == 'atlas':
+            atlas = self.get_glyph_atlas(font)
+            if atlas.supports(shape_text(word)):
+                return self.render_atlas_word(word, atlas, bg_color, width, height)
         
-        # Calculate text position (center)
-        temp_bbox = draw.textbbox((0, 0), word, font=font)
-        text_width = temp_bbox[2] - temp_bbox[0]
-        text_height = temp_bbox[3] - temp_bbox[1]
+        # Calculate text position: center the shaped text that is drawn,
+        # correcting for the offset of its box from the drawing origin
+        left, top, right, bottom = text_bbox(font, shape_text(word))
+        text_width = right - left
+        text_height = bottom - top
         
-        x = (width - text_width) // 2 + random.randint(-10, 10)
-        y = (height - text_height) // 2 + random.randint(-5, 5)
+        x = (width - text_width) // 2 - left + random.randint(-10, 10)
+        y = (height - text_height) // 2 - top + random.randint(-5, 5)
         
         # Base ink color (dark with variation)
         base_color = random.randint(0, 60)
         
         # Add handwriting variations
-        self.add_handwriting_variations_arabic(draw, word, x, y, font, base_color)
+        mask, ink_color = self.add_handwriting_variations_arabic(word, x, y, font, base_color, (width, height))
+        return mask, bg_color, ink_color, False
+    
+    def generate_word_arrays(self, words, width=300, height=60):
+        """Generate handwritten-style grayscale images as one uint8 (B, H, W) array
+        
+        Returns (images, isolated): `isolated[i]` tells whether word i was
+        composed from handwritten isolated letters (see label_text).
+        """
+        rendered = [self.render_word(word, width, height) for word in words]
+        masks = np.stack([r[0] for r in rendered])
+        batch = self.compose_strokes(masks, [r[1] for r in rendered], [r[2] for r in rendered])
         
         # Add noise and effects
-        img = self.add_noise_and_effects(img)
+        return self.add_noise_and_effects(batch), [r[3] for r in rendered]
+    
+    def generate_word_images(self, words, width=300, height=60):
+        """Generate handwritten-style images for a batch of words in one (B, H, W) pass"""
+        arrays, _ = self.generate_word_arrays(words, width, height)
+        return [Image.fromarray(img).convert('RGB') for img in arrays]
+    
+    def generate_word_image(self, word, width=300, height=60):
+        """Generate a handwritten-style image of an Arabic word"""
+        return self.generate_word_images([word], width, height)[0]
+    
+    def label_text(self, word, save_visual_order=True, isolated=False):
+        """Label of a word, in visual (RTL, reshaped) or logical order
+        
+        Words drawn from handwritten isolated letters keep their letters
+        unshaped in visual order.
+        """
+        if save_visual_order and isolated:
+            return get_display(word)
+        if save_visual_order:
+            # Text as it appears visually in the image (after reshaping)
+            return shape_text(word)
+        # Logical order (original)
+        return word
+    
+    def save_sample(self, i, word, img, save_visual_order=True, isolated=False):
+        """Save image and label of sample number `i`"""
+        # Save image
+        img_filename = f"word_{i:06d}.png"
+        img_path = self.images_dir / img_filename
+        if self.store:
+            buf = io.BytesIO()
+            img.save(buf, format='PNG')
+            self.store.put_and_link(buf.getvalue(), str(img_path))
+        else:
+            img.save(img_path)
+        
+        # Save corresponding text file
+        txt_filename = f"word_{i:06d}.txt"
+        txt_path = self.labels_dir / txt_filename
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write(self.label_text(word, save_visual_order, isolated))
+    
+    def seed_chunk(self, seed, start):
+        """Reseed the RNGs deterministically for the chunk starting at sample `start`"""
+        chunk_seed = int(np.random.SeedSequence([seed, start]).generate_state(1)[0])
+        random.seed(chunk_seed)
+        self.rng = np.random.default_rng(chunk_seed)
+    
+    @staticmethod
+    def master_seed(seed=None):
+        """`seed`, or a fresh random one: chunks are always reseeded, otherwise
+        every worker would start from a copy of the same RNG state"""
+        return int(np.random.SeedSequence().entropy) if seed is None else seed
+    
+    def iter_batches(self, start, stop, seed=None, batch_size=64):
+        """Render samples start..stop-1 (one chunk), `batch_size` images at a time
+        
+        Yields (indices, words, images, isolated) per batch, as returned by
+        generate_word_arrays. With a seed, the chunk is reseeded first.
+        """
+        if seed is not None:
+            self.seed_chunk(seed, start)
+        for batch_start in range(start, stop, batch_size):
+            indices = range(batch_start, min(batch_start + batch_size, stop))
+            # Generate synthetic words
+            words = [self.generate_synthetic_arabic_word() for _ in indices]
+            # Generate images
+            arrays, isolated_flags = self.generate_word_arrays(words)
+            yield indices, words, arrays, isolated_flags
+    
+    def generate_range(self, start, stop, save_visual_order=True, seed=None, batch_size=64):
+        """Generate samples start..stop-1 (one chunk) as PNG and .txt files"""
+        for indices, words, arrays, isolated_flags in self.iter_batches(start, stop, seed, batch_size):
+            for i, word, arr, isolated in zip(indices, words, arrays, isolated_flags):
+                self.save_sample(i, word, Image.fromarray(arr).convert('RGB'), save_visual_order, isolated)
+        return stop - start
+    
+    def shard_range(self, start, stop, save_visual_order=True, seed=None, batch_size=64):
+        """Generate samples start..stop-1 as (key, PNG bytes, label) for a ShardWriter"""
+        samples = []
+        for indices, words, arrays, isolated_flags in self.iter_batches(start, stop, seed, batch_size):
+            for i, word, arr, isolated in zip(indices, words, arrays, isolated_flags):
+                samples.append((f"word_{i:06d}", cv2.imencode('.png', arr)[1].tobytes(),
+                                self.label_text(word, save_visual_order, isolated)))
+        return samples
+    
+    def encode_range(self, start, stop, save_visual_order=True, seed=None,
+                     batch_size=64, save_png=False):
+        """Generate samples start..stop-1 straight into the binary training format
         
-        return img
+        Returns (encoded image, label) pairs, with the same words and images as
+        generate_range for the same seed. PNG/label files are only written if
+        save_png is True.
+        """
+        samples = []
+        for indices, words, arrays, isolated_flags in self.iter_batches(start, stop, seed, batch_size):
+            encoded = encode_images(list(arrays))
+            for i, word, arr, img, isolated in zip(indices, words, arrays, encoded, isolated_flags):
+                if save_png:
+                    self.save_sample(i, word, Image.fromarray(arr).convert('RGB'), save_visual_order, isolated)
+                label = self.label_text(word, save_visual_order, isolated).strip()
+                if is_valid_label(label):
+                    samples.append((img, label))
+        return samples
     
-    def generate_dataset(self, num_samples=1000, save_visual_order=True):
+    def run_chunks(self, num_samples, chunk_fn, sink=None, workers=1, chunk_size=1000):
+        """Run `chunk_fn(start, stop)` over chunks of `chunk_size` samples
+        
+        Chunks run in a process pool when workers > 1; their results are
+        passed to `sink` in chunk order, with a progress line per chunk.
+        Returns the elapsed time, for report_throughput.
+        """
+        start_time = time.perf_counter()
+        chunks = [(start, min(start + chunk_size, num_samples))
+                  for start in range(0, num_samples, chunk_size)]
+        done = 0
+        
+        if workers <= 1:
+            results = (chunk_fn(start, stop) for start, stop in chunks)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(chunk_fn, *zip(*chunks)) if chunks else []
+        try:
+            for (start, stop), result in zip(chunks, results):
+                if sink is not None:
+                    sink(result)
+                done += stop - start
+                elapsed = time.perf_counter() - start_time
+                print(f"Generated {done} samples... ({done / elapsed:.1f} samples/sec)")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return time.perf_counter() - start_time
+    
+    @staticmethod
+    def report_throughput(num_samples, elapsed, workers):
+        print(f"Throughput: {num_samples / max(elapsed, 1e-9):.1f} samples/sec "
+              f"({elapsed:.1f}s, {max(workers, 1)} worker(s))")
+    
+    def generate_dataset(self, num_samples=1000, save_visual_order=True,
+                         workers=1, seed=None, chunk_size=1000,
+                         shard_dir=None, samples_per_shard=SAMPLES_PER_SHARD, compression=None):
         """Generate a complete dataset of Arabic word images and labels
         
         Args:
             num_samples: Number of samples to generate
             save_visual_order: If True, save text as it appears visually (RTL).
                              If False, save in logical order (for some OCR models)
+            workers: Number of processes. Samples are split into chunks of
+                     `chunk_size` indices generated in parallel.
+            seed: Master seed. Each chunk reseeds from (seed, chunk start), so
+                  the output is byte-identical for the same seed whatever the
+                  number of workers. None draws a fresh master seed.
+            chunk_size: Number of samples per chunk
+            shard_dir: If set, write tar shards of `samples_per_shard` samples
+                       (optionally compressed: "gz", "bz2", "xz") there instead
+                       of one PNG and one .txt file per sample (see shards.py)
         """
+        seed = self.master_seed(seed)
+        if shard_dir is not None:
+            return self.generate_shards(num_samples, shard_dir, save_visual_order, workers, seed,
+                                        chunk_size, samples_per_shard, compression)
         print(f"Generating {num_samples} Arabic word samples...")
-        
-        for i in range(num_samples):
-            # Generate synthetic word
-            word = self.generate_synthetic_arabic_word()
-            
-            # Generate image
-            img = self.generate_word_image(word)
-            
-            # Save image
-            img_filename = f"word_{i:06d}.png"
-            img_path = self.images_dir / img_filename
-            img.save(img_path)
-            
-            # Save corresponding text file
-            txt_filename = f"word_{i:06d}.txt"
-            txt_path = self.labels_dir / txt_filename
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                if save_visual_order:
-                    # Save text as it appears visually in the image (after reshaping)
-                    try:
-                        reshaped_text = arabic_reshaper.reshape(word)
-                        display_text = get_display(reshaped_text)
-                        f.write(display_text)
-                    except:
-                        # Fallback to original if reshaping fails
-                        f.write(word)
-                else:
-                    # Save in logical order (original)
-                    f.write(word)
-            
-            if (i + 1) % 100 == 0:
-                print(f"Generated {i + 1} samples...")
+        elapsed = self.run_chunks(num_samples, partial(self.generate_range, save_visual_order=save_visual_order,
+                                                       seed=seed),
+                                  workers=workers, chunk_size=chunk_size)
         
         print(f"Dataset generation complete! Files saved in '{self.output_dir}'")
         print(f"Images: {self.images_dir}")
         print(f"Labels: {self.labels_dir}")
+        self.report_throughput(num_samples, elapsed, workers)
+    
+    def generate_shards(self, num_samples, shard_dir, save_visual_order=True, workers=1, seed=None,
+                        chunk_size=1000, samples_per_shard=SAMPLES_PER_SHARD, compression=None):
+        """Generate samples into tar shards; chunks are rendered in parallel and written in order"""
+        seed = self.master_seed(seed)
+        print(f"Generating {num_samples} Arabic word samples into shards in {shard_dir}...")
+        
+        with ShardWriter(shard_dir, samples_per_shard, compression) as writer:
+            def sink(samples):
+                for key, png, label in samples:
+                    writer.write(key, png, label)
+            elapsed = self.run_chunks(num_samples, partial(self.shard_range, save_visual_order=save_visual_order,
+                                                           seed=seed),
+                                      sink, workers, chunk_size)
+        
+        print(f"Wrote {writer.count} samples in {len(writer.shards)} shard(s) to '{shard_dir}'")
+        self.report_throughput(num_samples, elapsed, workers)
+        return writer.shards
+    
+    def generate_binary_dataset(self, num_samples=1000, bin_path="binary_dataset/my_dataset.bin",
+                                txt_path="binary_dataset/my_dataset.txt", save_visual_order=True,
+                                workers=1, seed=None, chunk_size=1000, save_png=False):
+        """Stream generated samples through preprocess into my_dataset.bin / .txt
+        
+        Same output as generate_dataset followed by imagestobinary.py, without
+        the PNG encode/decode and per-sample files (unless save_png is True).
+        Chunks are produced in parallel when workers > 1 and written in order.
+        """
+        seed = self.master_seed(seed)
+        print(f"Generating {num_samples} Arabic word samples into {bin_path}...")
+        
+        with BinaryDatasetWriter(bin_path, txt_path) as writer:
+            def sink(samples):
+                for img, label in samples:
+                    writer.write(img, label)
+            elapsed = self.run_chunks(num_samples, partial(self.encode_range, save_visual_order=save_visual_order,
+                                                           seed=seed, save_png=save_png),
+                                      sink, workers, chunk_size)
+        
+        print(f"Wrote {writer.index} samples to {bin_path} and {txt_path}")
+        self.report_throughput(num_samples, elapsed, workers)
+        return writer.index
 
 # Usage example
 if __name__ == "__main__":
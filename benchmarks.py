@@ -0,0 +1,326 @@
+"""
+Benchmark harness for every stage of the pipeline.
+
+Each benchmark runs in a fresh process (so peak RSS is its own), on fixed
+seeds and synthetic inputs, and reports its best time over --repeat runs:
+
+    python benchmarks.py --json results.json
+    python benchmarks.py --only preprocess segmentation --baseline results.json
+
+With --baseline, throughputs are compared to a previous --json output and
+the exit status is 1 if any benchmark got slower than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2
+
+BENCHMARKS = {}
+
+
+def benchmark(name, unit):
+    """Register `fn(workdir, scale)`: it prepares its inputs and returns
+    (run, items) where `run()` is the timed section processing `items`."""
+    def register(fn):
+        BENCHMARKS[name] = (fn, unit)
+        return fn
+    return register
+
+
+def _n(base, scale):
+    return max(1, int(base * scale))
+
+
+# --- Synthetic word data generator ---
+
+@benchmark("generate_word_image", "images/s")
+def bench_generate_word_image(workdir, scale):
+    from arabic_data_generator import ArabicOCRWordGenerator
+    generator = ArabicOCRWordGenerator(os.path.join(workdir, "gen"))
+    generator.seed_chunk(0, 0)
+    words = [generator.generate_synthetic_arabic_word() for _ in range(_n(200, scale))]
+    return (lambda: [generator.generate_word_image(word) for word in words]), len(words)
+
+
+@benchmark("generate_word_atlas", "images/s")
+def bench_generate_word_image_atlas(workdir, scale):
+    """Same words as generate_word_image, composed from the glyph atlas."""
+    from arabic_data_generator import ArabicOCRWordGenerator
+    generator = ArabicOCRWordGenerator(os.path.join(workdir, "gen"), engine="atlas")
+    generator.seed_chunk(0, 0)
+    words = [generator.generate_synthetic_arabic_word() for _ in range(_n(200, scale))]
+    return (lambda: [generator.generate_word_image(word) for word in words]), len(words)
+
+
+@benchmark("generate_dataset", "samples/s")
+def bench_generate_dataset(workdir, scale):
+    from arabic_data_generator import ArabicOCRWordGenerator
+    generator = ArabicOCRWordGenerator(os.path.join(workdir, "gen"))
+    n = _n(500, scale)
+    return (lambda: generator.generate_dataset(n, seed=0)), n
+
+
+# --- Preprocessing ---
+
+def _random_crops(n):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (rng.integers(20, 80), rng.integers(40, 300)), dtype=np.uint8)
+            for _ in range(n)]
+
+
+@benchmark("preprocess", "images/s")
+def bench_preprocess(workdir, scale):
+    from preprocessor import preprocess
+    imgs = _random_crops(_n(4000, scale))
+    return (lambda: [preprocess(img) for img in imgs]), len(imgs)
+
+
+@benchmark("preprocess_batch", "images/s")
+def bench_preprocess_batch(workdir, scale):
+    from preprocessor import preprocess_batch
+    imgs = _random_crops(_n(4000, scale))
+    return (lambda: preprocess_batch(imgs)), len(imgs)
+
+
+# --- imagestobinary.py conversion ---
+
+@benchmark("imagestobinary", "images/s")
+def bench_imagestobinary(workdir, scale):
+    from arabic_data_generator import ArabicOCRWordGenerator
+    from imagestobinary import convert
+    generator = ArabicOCRWordGenerator(os.path.join(workdir, "gen"))
+    n = _n(1000, scale)
+    generator.generate_dataset(n, seed=0)
+    bin_path, txt_path = os.path.join(workdir, "out.bin"), os.path.join(workdir, "out.txt")
+    return (lambda: convert(str(generator.images_dir), str(generator.labels_dir),
+                            bin_path, txt_path, workers=1)), n
+
+
+# --- Word segmentation ---
+
+def _synthetic_page(path, seed=0):
+    """A test.jpg-like scanned page: rows of printed words on white paper."""
+    rng = np.random.default_rng(seed)
+    page = np.full((1400, 1000, 3), 255, np.uint8)
+    for y in range(80, 1320, 70):
+        x = 940
+        while x > 120:
+            w = int(rng.integers(60, 160))
+            cv2.putText(page, "w" * max(1, w // 22), (x - w, y), cv2.FONT_HERSHEY_SIMPLEX,
+                        1.0, (20, 20, 20), 2, cv2.LINE_AA)
+            x -= w + int(rng.integers(30, 60))
+    cv2.imwrite(path, page)
+
+
+def _page(workdir):
+    if os.path.exists("test.jpg"):
+        return "test.jpg"
+    page = os.path.join(workdir, "page.png")
+    _synthetic_page(page)
+    return page
+
+
+@benchmark("find_word_boxes", "pages/s")
+def bench_find_word_boxes(workdir, scale):
+    from word_segementation import find_word_boxes
+    image = cv2.imread(_page(workdir))
+    pages = _n(50, scale)
+    return (lambda: [find_word_boxes(image) for _ in range(pages)]), pages
+
+
+@benchmark("segmentation", "pages/s")
+def bench_segmentation(workdir, scale):
+    """End to end for single pages (in-process), including the crop/manifest writes."""
+    from word_segementation import segment_arabic_words
+    page = _page(workdir)
+    pages = _n(10, scale)
+    out = os.path.join(workdir, "words")
+
+    def run():
+        for _ in range(pages):
+            shutil.rmtree(out, ignore_errors=True)
+            segment_arabic_words(page, out)
+    return run, pages
+
+
+@benchmark("segmentation_pool", "pages/s")
+def bench_segmentation_pool(workdir, scale):
+    """segment_pages over a batch of pages in a 2-process pool."""
+    from word_segementation import segment_pages
+    page = _page(workdir)
+    pages = [page] * _n(20, scale)
+    out = os.path.join(workdir, "words")
+
+    def run():
+        shutil.rmtree(out, ignore_errors=True)
+        segment_pages(pages, out, workers=2)
+    return run, len(pages)
+
+
+# --- Flask annotation path ---
+
+@benchmark("annotate", "requests/s")
+def bench_annotate(workdir, scale, db_size=None):
+    import db
+    import app
+    db_size = db_size or _n(100000, scale)
+    db.DB_PATH = os.path.join(workdir, "words.db")
+    app.EXPORT_MODE = "manual"
+    db.init_schema()
+    db.insert_images({'path': f"static/words/words_output/word_{i:06d}.png"} for i in range(db_size))
+    db.release_db()
+
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['annotator'] = "bench"
+    cycles = _n(200, scale)
+
+    def run():
+        # A fresh batch per run, as after the home page form
+        db.assign_images_to_user("bench", batch_size=cycles)
+        db.release_db()
+        # One annotation = the page view, then the label POST
+        for _ in range(cycles):
+            page = client.get("/annotate").get_data(as_text=True)
+            image_id = page.split('name="image_id" value="', 1)[1].split('"', 1)[0]
+            client.post("/annotate", data={"image_id": image_id, "action": "add", "text": "كتب"})
+    return run, 2 * cycles
+
+
+# --- Runner ---
+
+def _peak_rss_mb():
+    # Worker processes (segmentation pool) count too
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_one(name, scale, repeat, db_size):
+    """Run one benchmark in the current (fresh) process."""
+    fn, unit = BENCHMARKS[name]
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    # The pipeline prints progress: keep the report readable
+    devnull = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        kwargs = {"db_size": db_size} if name == "annotate" else {}
+        run, items = fn(workdir, scale, **kwargs)
+        try:
+            run()  # warm-up (imports, font and DB caches)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+            # Allocation tracing slows Python code down: separate, untimed run
+            tracemalloc.start()
+            run()
+            traced_peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    best = min(times)
+    return {
+        "name": name,
+        "unit": unit,
+        "items": items,
+        "seconds": best,
+        "median_seconds": float(np.median(times)),
+        "throughput": items / best,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "peak_traced_mb": round(traced_peak / 2**20, 1),
+    }
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run_benchmarks(names=None, scale=1.0, repeat=3, db_size=None):
+    """Run the selected benchmarks, each in its own process. Returns the report dict."""
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name in names or BENCHMARKS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(_run_one, name, scale, repeat, db_size).result()
+        print(f"{name:<20} {result['throughput']:>10.1f} {result['unit']:<11} "
+              f"({result['items']} in {result['seconds']:.3f}s, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB, traced {result['peak_traced_mb']:.0f} MB)")
+        results.append(result)
+    return {"environment": _environment(),
+            "settings": {"scale": scale, "repeat": repeat, "db_size": db_size},
+            "results": results}
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Names of the benchmarks slower than `baseline` by more than `tolerance`."""
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = previous.get(result["name"])
+        if old is None:
+            continue
+        ratio = result["throughput"] / old["throughput"]
+        flag = "REGRESSION" if ratio < 1 - tolerance else ""
+        print(f"{result['name']:<20} {ratio:>6.2f}x vs baseline {flag}")
+        if flag:
+            regressions.append(result["name"])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the OCR data preparation pipeline")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the input sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark (best is kept)")
+    parser.add_argument("--db-size", type=int, default=None,
+                        help="rows of the synthetic words.db for 'annotate' (default 100000 x scale)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="previous --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed throughput drop vs baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.only, args.scale, args.repeat, args.db_size)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            if compare(report, json.load(f), args.tolerance):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
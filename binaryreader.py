@@ -0,0 +1,142 @@
+import os
+import numpy as np
+
+# === CHEMINS ===
+bin_path = "binary_dataset/my_dataset.bin"
+txt_path = "binary_dataset/my_dataset.txt"
+
+# Version du format de l'index en cache (à incrémenter s'il change)
+INDEX_VERSION = 1
+
+
+def parse_index(txt_path):
+    """
+    Lit l'index texte (image idx:...;start position:...;image height:...;
+    image width:...;...;word:...) en tableaux compacts.
+    Les mots sont concaténés en UTF-8 dans `labels`, délimités par `label_offsets`.
+    """
+    offsets, heights, widths, label_offsets = [], [], [], [0]
+    labels = bytearray()
+    with open(txt_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            # Le mot est le dernier champ et peut contenir des ';'
+            fields, _, word = line.partition(";word:")
+            values = dict(field.split(":", 1) for field in fields.split(";"))
+            offsets.append(int(values["start position"]))
+            heights.append(int(values["image height"]))
+            widths.append(int(values["image width"]))
+            labels += word.encode("utf-8")
+            label_offsets.append(len(labels))
+
+    return {
+        "offsets": np.array(offsets, dtype=np.int64),
+        "heights": np.array(heights, dtype=np.int32),
+        "widths": np.array(widths, dtype=np.int32),
+        "label_offsets": np.array(label_offsets, dtype=np.int64),
+        "labels": np.frombuffer(bytes(labels), dtype=np.uint8),
+    }
+
+
+def load_index(txt_path, cache_path=None):
+    """
+    Index parsé, relu depuis le cache binaire `<txt>.idx.npz` s'il est à jour
+    (même taille et date de modification du .txt), sinon reconstruit et mis en cache.
+    """
+    cache_path = cache_path or txt_path + ".idx.npz"
+    stat = os.stat(txt_path)
+    stamp = np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached["stamp"], stamp):
+                    return {key: cached[key] for key in cached.files if key != "stamp"}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = parse_index(txt_path)
+    try:
+        with open(cache_path, "wb") as f:
+            np.savez(f, stamp=stamp, **index)
+    except OSError:
+        pass  # dossier en lecture seule : on se passe du cache
+    return index
+
+
+class BinaryDatasetReader:
+    """
+    Accès aléatoire à my_dataset.bin / my_dataset.txt sans tout charger :
+    le .bin est projeté en mémoire (np.memmap) et reader[i] renvoie une vue
+    (h, w) uint8 sans copie, avec son mot.
+    """
+
+    def __init__(self, bin_path=bin_path, txt_path=txt_path, cache_path=None):
+        index = load_index(txt_path, cache_path)
+        self.offsets = index["offsets"]
+        self.heights = index["heights"]
+        self.widths = index["widths"]
+        self.label_offsets = index["label_offsets"]
+        self.labels = index["labels"]
+        self.data = np.memmap(bin_path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def image(self, i):
+        start = self.offsets[i]
+        h, w = self.heights[i], self.widths[i]
+        return self.data[start:start + h * w].reshape(h, w)
+
+    def word(self, i):
+        return self.labels[self.label_offsets[i]:self.label_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError(f"image index {key} out of range")
+            return self.image(key), self.word(key)
+        if isinstance(key, slice):
+            return self.get_batch(np.arange(len(self))[key])
+        return self.get_batch(key)
+
+    def get_batch(self, indices):
+        """
+        Images d'un lot et leurs mots. Si toutes les images ont la même taille,
+        renvoie un tableau (B, h, w) — une vue sans copie quand les images sont
+        contiguës dans le .bin — sinon une liste d'images.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        words = [self.word(i) for i in indices]
+        if len(indices) == 0:
+            return np.empty((0, 0, 0), dtype=np.uint8), words
+
+        heights, widths = self.heights[indices], self.widths[indices]
+        if (heights != heights[0]).any() or (widths != widths[0]).any():
+            return [self.image(i) for i in indices], words
+
+        h, w = int(heights[0]), int(widths[0])
+        offsets = self.offsets[indices]
+        if (np.diff(offsets) == h * w).all():
+            start = offsets[0]
+            return self.data[start:start + len(indices) * h * w].reshape(-1, h, w), words
+        batch = np.empty((len(indices), h, w), dtype=np.uint8)
+        for j, start in enumerate(offsets):
+            batch[j] = self.data[start:start + h * w].reshape(h, w)
+        return batch, words
+
+    def iter_batches(self, batch_size=64, shuffle=True, seed=None, drop_last=False):
+        """Parcourt une époque par lots, dans un ordre aléatoire reproductible avec `seed`."""
+        order = np.random.default_rng(seed).permutation(len(self)) if shuffle else np.arange(len(self))
+        stop = len(order) - len(order) % batch_size if drop_last else len(order)
+        for start in range(0, stop, batch_size):
+            yield self.get_batch(order[start:start + batch_size])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.image(i), self.word(i)
@@ -0,0 +1,83 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+STORE_DIR = "blobs"
+
+
+def link_or_copy(src, dest):
+    """
+    Make `dest` refer to the same bytes as `src`: a hardlink when possible
+    (no data copied), a copy across filesystems. Replaces `dest` atomically.
+    """
+    # Already the same file: os.replace() would be a no-op and leave the temp name
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return
+    dest_dir = os.path.dirname(dest) or "."
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dest_dir, prefix=".link-")
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    try:
+        os.replace(tmp, dest)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+
+class BlobStore:
+    """
+    Content-addressed image store: each distinct image is stored once, as
+    <root>/<2 first hex digits>/<sha256>.<ext>. Working folders (segmented
+    words, exported dataset, generated data) hold hardlinks to the blobs
+    instead of copies, and identical images are detected by their hash.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def path_for(self, digest, ext=".png"):
+        return os.path.join(self.root, digest[:2], digest + ext)
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def put_bytes(self, data, ext=".png"):
+        """Store encoded image bytes. Returns (digest, blob path, is_new)."""
+        digest = self.digest(data)
+        path = self.path_for(digest, ext)
+        if os.path.exists(path):
+            return digest, path, False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return digest, path, True
+
+    def put_file(self, src):
+        """Store an existing image file (hardlinked in when possible)."""
+        with open(src, "rb") as f:
+            digest = self.digest(f.read())
+        path = self.path_for(digest, os.path.splitext(src)[1] or ".png")
+        if os.path.exists(path):
+            return digest, path, False
+        link_or_copy(src, path)
+        return digest, path, True
+
+    def put_and_link(self, data, dest):
+        """Store bytes and expose them at `dest`. Returns (digest, is_new)."""
+        digest, path, is_new = self.put_bytes(data, os.path.splitext(dest)[1] or ".png")
+        link_or_copy(path, dest)
+        return digest, is_new
@@ -0,0 +1,538 @@
+import time
+import queue
+import sqlite3
+import datetime
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+# --- CONFIGURATION ---
+DB_PATH = 'words.db'
+IMG_FOLDER = 'static/words/words_output'  # crops indexés par l'app et ingest.py
+POOL_SIZE = 16
+BUSY_TIMEOUT_MS = 5000
+COUNTERS_TTL = 2.0  # secondes
+LEASE_DURATION = datetime.timedelta(hours=3)  # durée d'une assignation
+SWEEP_INTERVAL = 60  # secondes entre deux passages du sweeper
+
+# --- CONNEXIONS ---
+# Chaque requête SQL (et la lecture de ses résultats) est chronométrée et
+# comptée dans metrics : phase "db" de la requête HTTP en cours
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            metrics.record_query(time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            metrics.record_query(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.record_db_time(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.record_db_time(time.perf_counter() - start)
+
+class TimedConnection(sqlite3.Connection):
+    def execute(self, *args):
+        return self.cursor(_TimedCursor).execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor(_TimedCursor).executemany(*args)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            metrics.record_db_time(time.perf_counter() - start)
+
+_pool = queue.LifoQueue()
+_local = threading.local()
+
+def connect(db_path=None):
+    """Ouvre une connexion configurée (WAL, busy_timeout, cache de requêtes)."""
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None, check_same_thread=False,
+                           cached_statements=128, factory=TimedConnection)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def get_db():
+    """
+    Connexion du thread courant : réutilisée par tous les appels d'une même
+    requête, puis rendue au pool par release_db().
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            conn = connect()
+        _local.conn = conn
+    return conn
+
+def release_db():
+    """Rend la connexion du thread courant au pool."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    if _pool.qsize() < POOL_SIZE:
+        _pool.put(conn)
+    else:
+        conn.close()
+
+@contextmanager
+def transaction(conn=None):
+    """Transaction d'écriture : BEGIN IMMEDIATE pour prendre le verrou d'écriture d'emblée."""
+    conn = conn or get_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+# --- SCHÉMA ---
+def init_schema(conn=None):
+    conn = conn or get_db()
+    with transaction(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT UNIQUE,
+                text TEXT,
+                status TEXT CHECK(status IN ('pending', 'processing', 'annotated')) DEFAULT 'pending',
+                annotator TEXT,
+                assigned_at TIMESTAMP
+            )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(images)")}
+
+        # Suivi de l'export : hash du contenu exporté + drapeau "à ré-exporter"
+        if 'exported_hash' not in columns:
+            conn.execute("ALTER TABLE images ADD COLUMN exported_hash TEXT")
+        if 'exported_at' not in columns:
+            conn.execute("ALTER TABLE images ADD COLUMN exported_at TIMESTAMP")
+        if 'export_dirty' not in columns:
+            conn.execute("ALTER TABLE images ADD COLUMN export_dirty INTEGER NOT NULL DEFAULT 0")
+            # Les lignes déjà annotées doivent être exportées une première fois
+            conn.execute("UPDATE images SET export_dirty = 1 WHERE text IS NOT NULL")
+
+        # Provenance des images segmentées : page source et boîte englobante
+        for column in ('page TEXT', 'bbox_x INTEGER', 'bbox_y INTEGER', 'bbox_w INTEGER', 'bbox_h INTEGER'):
+            if column.split()[0] not in columns:
+                conn.execute(f"ALTER TABLE images ADD COLUMN {column}")
+
+        # Hash du contenu (sha256 du blob) : détecte les crops en double à l'ingestion
+        if 'content_hash' not in columns:
+            conn.execute("ALTER TABLE images ADD COLUMN content_hash TEXT")
+
+        # Date de la (dernière) annotation, pour filtrer la relecture par période
+        if 'annotated_at' not in columns:
+            conn.execute("ALTER TABLE images ADD COLUMN annotated_at TIMESTAMP")
+
+        # Toute modification du texte, du statut ou du chemin marque la ligne à ré-exporter
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS images_export_dirty
+            AFTER UPDATE OF text, status, path ON images
+            BEGIN
+                UPDATE images SET export_dirty = 1 WHERE id = NEW.id;
+            END
+        """)
+
+        # Index des requêtes chaudes
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_export_dirty ON images(id) WHERE export_dirty = 1")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_status_annotator ON images(status, annotator)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_assigned_at ON images(assigned_at)")
+        conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_images_content_hash
+            ON images(content_hash) WHERE content_hash IS NOT NULL
+        """)
+        # Relecture : recherche exacte / par préfixe et filtres annotateur + date
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_text ON images(text) WHERE text IS NOT NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_annotator_date ON images(annotator, annotated_at)")
+
+        _init_counters(conn)
+        _init_search(conn)
+
+# --- COMPTEURS MAINTENUS PAR TRIGGERS ---
+# Une ligne par (statut, annotateur, texte saisi ?) : la table reste de la
+# taille du nombre d'annotateurs, quelle que soit la taille de `images`.
+_COUNTER_DELTA = """
+    INSERT INTO status_counts (status, annotator, has_text, n)
+    VALUES ({row}.status, COALESCE({row}.annotator, ''), {row}.text IS NOT NULL, {delta})
+    ON CONFLICT (status, annotator, has_text) DO UPDATE SET n = n + ({delta});
+"""
+
+def _init_counters(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'status_counts'").fetchone()
+    if exists:
+        return
+    conn.execute("""
+        CREATE TABLE status_counts (
+            status TEXT NOT NULL,
+            annotator TEXT NOT NULL,
+            has_text INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (status, annotator, has_text)
+        )
+    """)
+    conn.execute("""
+        INSERT INTO status_counts (status, annotator, has_text, n)
+        SELECT status, COALESCE(annotator, ''), text IS NOT NULL, COUNT(*)
+        FROM images GROUP BY 1, 2, 3
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS images_counts_insert AFTER INSERT ON images
+        BEGIN {_COUNTER_DELTA.format(row='NEW', delta=1)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS images_counts_delete AFTER DELETE ON images
+        BEGIN {_COUNTER_DELTA.format(row='OLD', delta=-1)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS images_counts_update
+        AFTER UPDATE OF status, annotator, text ON images
+        BEGIN
+            {_COUNTER_DELTA.format(row='OLD', delta=-1)}
+            {_COUNTER_DELTA.format(row='NEW', delta=1)}
+        END
+    """)
+
+# --- INDEX DE RECHERCHE DES LABELS ---
+# Table FTS5 à contenu externe (le texte reste dans `images`), tokenizer
+# trigram : toute sous-chaîne d'au moins 3 caractères est une recherche indexée.
+def _init_search(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'").fetchone()
+    if exists:
+        return
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE images_fts
+            USING fts5(text, content='images', content_rowid='id', tokenize='trigram')
+        """)
+    except sqlite3.OperationalError:
+        return  # SQLite sans FTS5 / trigram (< 3.34) : search_labels passe par LIKE
+    conn.execute("INSERT INTO images_fts (rowid, text) SELECT id, text FROM images WHERE text IS NOT NULL")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images
+        WHEN NEW.text IS NOT NULL
+        BEGIN
+            INSERT INTO images_fts (rowid, text) VALUES (NEW.id, NEW.text);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images
+        WHEN OLD.text IS NOT NULL
+        BEGIN
+            INSERT INTO images_fts (images_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE OF text ON images
+        WHEN OLD.text IS NOT NEW.text
+        BEGIN
+            INSERT INTO images_fts (images_fts, rowid, text)
+            SELECT 'delete', OLD.id, OLD.text WHERE OLD.text IS NOT NULL;
+            INSERT INTO images_fts (rowid, text)
+            SELECT NEW.id, NEW.text WHERE NEW.text IS NOT NULL;
+        END
+    """)
+
+# --- STATISTIQUES ---
+_counters_cache = {}
+_counters_lock = threading.Lock()
+
+def get_counters(annotator=None):
+    """
+    Tous les compteurs des pages en une requête sur status_counts, gardés
+    COUNTERS_TTL secondes en cache :
+    total, annotated, not_annotated, processing et remaining (pour `annotator`).
+    """
+    now = time.monotonic()
+    with _counters_lock:
+        cached = _counters_cache.get(annotator)
+    if cached and now - cached[0] < COUNTERS_TTL:
+        return cached[1]
+
+    total, annotated, processing, remaining = get_db().execute("""
+        SELECT COALESCE(SUM(n), 0),
+               COALESCE(SUM(CASE WHEN status = 'annotated' THEN n END), 0),
+               COALESCE(SUM(CASE WHEN status = 'processing' AND annotator = ? THEN n END), 0),
+               COALESCE(SUM(CASE WHEN status = 'processing' AND annotator = ? AND NOT has_text THEN n END), 0)
+        FROM status_counts
+    """, (annotator, annotator)).fetchone()
+    counters = {
+        'total': total,
+        'annotated': annotated,
+        'not_annotated': total - annotated,
+        'processing': processing,
+        'remaining': remaining,
+    }
+    with _counters_lock:
+        _counters_cache[annotator] = (now, counters)
+    return counters
+
+def invalidate_counters():
+    with _counters_lock:
+        _counters_cache.clear()
+
+# --- INGESTION ---
+def insert_images(rows):
+    """
+    Ajoute des images en pending, en une seule transaction (executemany).
+    `rows` : dicts avec 'path' et, optionnellement, 'page', 'x', 'y', 'w', 'h', 'hash'.
+    Les chemins et les contenus (hash) déjà présents sont ignorés.
+    Retourne le nombre d'images ajoutées.
+    """
+    params = [(row['path'], row.get('page'), row.get('x'), row.get('y'), row.get('w'), row.get('h'),
+               row.get('hash') or None)
+              for row in rows]
+    with transaction() as conn:
+        inserted = conn.executemany("""
+            INSERT OR IGNORE INTO images (path, status, page, bbox_x, bbox_y, bbox_w, bbox_h, content_hash)
+            VALUES (?, 'pending', ?, ?, ?, ?, ?, ?)
+        """, params).rowcount
+    invalidate_counters()
+    return inserted
+
+def known_hashes(hashes):
+    """Chemins des images déjà en base pour ces hashes de contenu : {hash: path}."""
+    hashes = list(hashes)
+    conn = get_db()
+    known = {}
+    # Par paquets, sous la limite de paramètres de SQLite
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        known.update(conn.execute(
+            f"SELECT content_hash, path FROM images WHERE content_hash IN ({','.join('?' * len(chunk))})",
+            chunk).fetchall())
+    return known
+
+# --- EXPIRATION DES ASSIGNATIONS ---
+def _lease_cutoff():
+    return datetime.datetime.now() - LEASE_DURATION
+
+def reset_expired_assignments():
+    """Remet en pending les images assignées depuis plus de LEASE_DURATION."""
+    with transaction() as conn:
+        expired = conn.execute("""
+            UPDATE images
+            SET status = 'pending', annotator = NULL, assigned_at = NULL
+            WHERE assigned_at < ? AND status = 'processing'
+        """, (_lease_cutoff(),)).rowcount
+    if expired:
+        invalidate_counters()
+    return expired
+
+_sweeper_thread = None
+
+def _sweep_leases(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reset_expired_assignments()
+        except sqlite3.Error:
+            pass
+        finally:
+            release_db()
+
+def start_lease_sweeper(interval=None):
+    """Lance (une seule fois) le thread qui libère périodiquement les assignations expirées."""
+    global _sweeper_thread
+    if _sweeper_thread is None or not _sweeper_thread.is_alive():
+        _sweeper_thread = threading.Thread(target=_sweep_leases, args=(interval or SWEEP_INTERVAL,),
+                                           name="lease-sweeper", daemon=True)
+        _sweeper_thread.start()
+
+# --- ASSIGNATION D'IMAGES À UN UTILISATEUR ---
+def assign_images_to_user(annotator_name, batch_size=50):
+    """
+    Réserve atomiquement un lot d'images pour `annotator_name` s'il n'a plus
+    d'assignation valide. Les images pending et celles dont l'assignation a
+    expiré (sans attendre le sweeper) sont éligibles ; BEGIN IMMEDIATE
+    sérialise les réservations, donc deux annotateurs n'obtiennent jamais
+    les mêmes images. Retourne les ids réservés.
+    """
+    now = datetime.datetime.now()
+    cutoff = now - LEASE_DURATION
+    with transaction() as conn:
+        active = conn.execute("""
+            SELECT 1 FROM images
+            WHERE status = 'processing' AND annotator = ? AND assigned_at >= ?
+            LIMIT 1
+        """, (annotator_name, cutoff)).fetchone()
+        if active:
+            return []
+
+        # Ses anciennes images expirées retournent dans la file
+        conn.execute("""
+            UPDATE images
+            SET status = 'pending', annotator = NULL, assigned_at = NULL
+            WHERE status = 'processing' AND annotator = ? AND assigned_at < ?
+        """, (annotator_name, cutoff))
+
+        claimed = conn.execute("""
+            UPDATE images
+            SET status = 'processing', annotator = ?, assigned_at = ?
+            WHERE id IN (
+                SELECT id FROM images WHERE status = 'pending'
+                UNION ALL
+                SELECT id FROM images WHERE assigned_at < ? AND status = 'processing'
+                LIMIT ?
+            )
+            RETURNING id
+        """, (annotator_name, now, cutoff, batch_size)).fetchall()
+    invalidate_counters()
+    return [row[0] for row in claimed]
+
+# --- ANNOTATION ---
+def get_next_assigned_images(annotator, limit=10, exclude=()):
+    """
+    Prochaines images (id, path) assignées à l'annotateur avec un bail valide,
+    hors `exclude` (images déjà chez le client, en attente d'envoi).
+    """
+    exclude = list(exclude)
+    not_in = f"AND id NOT IN ({','.join('?' * len(exclude))})" if exclude else ""
+    return get_db().execute(f"""
+        SELECT id, path FROM images
+        WHERE status = 'processing' AND annotator = ? AND assigned_at >= ? {not_in}
+        ORDER BY id
+        LIMIT ?
+    """, (annotator, _lease_cutoff(), *exclude, limit)).fetchall()
+
+def get_next_assigned_image(annotator):
+    rows = get_next_assigned_images(annotator, 1)
+    return rows[0] if rows else None
+
+def submit_labels(annotator, labels=(), skipped=()):
+    """
+    Enregistre un lot d'annotations en une transaction.
+    `labels` : paires (image_id, texte) ; `skipped` : ids des images passées,
+    remises en pending. Retourne le nombre de lignes modifiées.
+    """
+    now = datetime.datetime.now()
+    with transaction() as conn:
+        updated = conn.executemany("""
+            UPDATE images
+            SET text = ?, status = 'annotated', annotated_at = ?
+            WHERE id = ? AND annotator = ?
+        """, [(text, now, image_id, annotator) for image_id, text in labels]).rowcount
+        updated += conn.executemany("""
+            UPDATE images
+            SET status = 'pending', annotator = NULL, assigned_at = NULL
+            WHERE id = ? AND annotator = ?
+        """, [(image_id, annotator) for image_id in skipped]).rowcount
+    invalidate_counters()
+    return updated
+
+def annotate_image(image_id, annotator, text):
+    submit_labels(annotator, labels=[(image_id, text)])
+
+def skip_image(image_id, annotator):
+    submit_labels(annotator, skipped=[image_id])
+
+# --- RELECTURE ---
+REVIEW_MODES = ('contains', 'prefix', 'exact')
+
+def _has_search_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'").fetchone() is not None
+
+def search_labels(query=None, mode='contains', annotator=None, since=None, until=None,
+                  status='annotated', before_id=None, limit=50):
+    """
+    Labels à relire, du plus récent (id décroissant) au plus ancien, par pages
+    de `limit` : la page suivante reprend avant le dernier id (`before_id`).
+    `mode` : 'contains' (sous-chaîne, index trigram dès 3 caractères),
+    'prefix' ou 'exact' (index sur images.text). `since` / `until` bornent
+    annotated_at ; `status` None = tous les statuts.
+    Retourne des lignes (id, path, text, status, annotator, annotated_at).
+    """
+    if mode not in REVIEW_MODES:
+        raise ValueError(f"mode inconnu : {mode!r}, attendu parmi {REVIEW_MODES}")
+    conn = get_db()
+    joins, where, params = "", [], []
+    if query:
+        if mode == 'exact':
+            where.append("i.text = ?")
+            params.append(query)
+        elif mode == 'prefix':
+            # Intervalle sur l'index (LIKE 'x%' ne l'utilise pas avec le texte arabe)
+            where.append("i.text >= ? AND i.text < ?")
+            params += [query, query + '\U0010ffff']
+        elif len(query) >= 3 and _has_search_index(conn):
+            joins = "JOIN images_fts f ON f.rowid = i.id"
+            where.append("images_fts MATCH ?")
+            params.append('"' + query.replace('"', '""') + '"')
+        else:
+            # Moins de 3 caractères : le trigram ne peut pas servir, parcours filtré
+            where.append("i.text LIKE ? ESCAPE '\\'")
+            params.append('%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    # `+i.status` : la plupart des lignes sont annotées, l'index du statut ne
+    # filtre presque rien et ne doit pas passer devant ceux du texte / de la date
+    for clause, value in (("+i.status = ?", status), ("i.annotator = ?", annotator),
+                          ("i.annotated_at >= ?", since), ("i.annotated_at < ?", until),
+                          ("i.id < ?", before_id)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    sql = f"""
+        SELECT i.id, i.path, i.text, i.status, i.annotator, i.annotated_at
+        FROM images i {joins}
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY i.id DESC
+        LIMIT ?
+    """
+    return conn.execute(sql, (*params, limit)).fetchall()
+
+def correct_label(image_id, text):
+    """Corrige un label en relecture, sans changer l'annotateur ni le statut."""
+    with transaction() as conn:
+        updated = conn.execute("""
+            UPDATE images SET text = ? WHERE id = ? AND status = 'annotated'
+        """, (text, image_id)).rowcount
+    invalidate_counters()
+    return updated > 0
+
+def reopen_images(image_ids, annotator=None):
+    """
+    Rouvre des images annotées pour une nouvelle saisie : label effacé,
+    assignées directement à `annotator` (bail neuf) ou remises dans la file
+    commune si None. Retourne le nombre d'images rouvertes.
+    """
+    status = 'processing' if annotator else 'pending'
+    assigned_at = datetime.datetime.now() if annotator else None
+    with transaction() as conn:
+        reopened = conn.executemany("""
+            UPDATE images
+            SET text = NULL, status = ?, annotator = ?, assigned_at = ?, annotated_at = NULL
+            WHERE id = ? AND status = 'annotated'
+        """, [(status, annotator, assigned_at, image_id) for image_id in image_ids]).rowcount
+    invalidate_counters()
+    return reopened
@@ -0,0 +1,153 @@
+import os
+import re
+import csv
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+
+# === CHEMINS ===
+ARCHIVE_DIR = "archive"
+CACHE_DIR = "cache/handwritten_chars"
+SPLITS = {
+    'train': ("Train Images 13440x32x32/train",
+              "Arabic Handwritten Characters Dataset CSV/csvTrainLabel 13440x1.csv"),
+    'test': ("Test Images 3360x32x32/test",
+             "Arabic Handwritten Characters Dataset CSV/csvTestLabel 3360x1.csv"),
+}
+
+# Version du format du cache (à incrémenter s'il change)
+CACHE_VERSION = 1
+
+# Classes 1..28 du dataset, dans l'ordre de l'alphabet
+LETTERS = ['ا', 'ب', 'ت', 'ث', 'ج', 'ح', 'خ', 'د', 'ذ', 'ر', 'ز', 'س', 'ش', 'ص',
+           'ض', 'ط', 'ظ', 'ع', 'غ', 'ف', 'ق', 'ك', 'ل', 'م', 'ن', 'ه', 'و', 'ي']
+
+_FILENAME = re.compile(r"id_(\d+)_label_(\d+)\.png$")
+
+
+def _split_paths(split, archive_dir):
+    images_dir, labels_csv = SPLITS[split]
+    return os.path.join(archive_dir, images_dir), os.path.join(archive_dir, labels_csv)
+
+
+def _stamp(images_dir, labels_csv):
+    """Identifie l'état des sources : le cache est reconstruit s'il change."""
+    return [CACHE_VERSION, os.stat(images_dir).st_mtime_ns,
+            os.stat(labels_csv).st_size, os.stat(labels_csv).st_mtime_ns]
+
+
+def build_split(split="train", archive_dir=ARCHIVE_DIR):
+    """
+    Lit un split (dossier d'images id_<n>_label_<k>.png + CSV des labels) en
+    tableaux : images uint8 (N, 32, 32), encre blanche sur fond noir, et
+    labels uint8 (N,) de 1 à 28, dans l'ordre des ids.
+    Vérifie que le nombre d'images correspond au nom du dossier
+    (« 13440x32x32 »), que les ids vont de 1 à N et que les labels du CSV
+    sont ceux des noms de fichiers ; lève ValueError sinon.
+    """
+    images_dir, labels_csv = _split_paths(split, archive_dir)
+    expected, h, w = (int(v) for v in re.search(r"(\d+)x(\d+)x(\d+)", images_dir).groups())
+
+    files = {}
+    for filename in os.listdir(images_dir):
+        match = _FILENAME.match(filename)
+        if match:
+            files[int(match.group(1))] = (filename, int(match.group(2)))
+    if len(files) != expected or set(files) != set(range(1, expected + 1)):
+        raise ValueError(f"{images_dir}: {len(files)} images, {expected} attendues (ids 1..{expected})")
+
+    with open(labels_csv, newline='') as f:
+        labels = np.array([int(row[0]) for row in csv.reader(f) if row], dtype=np.uint8)
+    if len(labels) != expected:
+        raise ValueError(f"{labels_csv}: {len(labels)} labels, {expected} attendus")
+    from_names = np.array([files[i][1] for i in range(1, expected + 1)], dtype=np.uint8)
+    mismatches = np.flatnonzero(labels != from_names)
+    if len(mismatches):
+        raise ValueError(f"{labels_csv}: {len(mismatches)} labels différents des noms de fichiers "
+                         f"(ids {', '.join(str(i + 1) for i in mismatches[:5])}...)")
+
+    images = np.empty((expected, h, w), dtype=np.uint8)
+    for i in range(1, expected + 1):
+        img = cv2.imread(os.path.join(images_dir, files[i][0]), cv2.IMREAD_GRAYSCALE)
+        if img is None or img.shape != (h, w):
+            raise ValueError(f"{files[i][0]}: image illisible ou de taille inattendue")
+        images[i - 1] = img
+    return images, labels
+
+
+def load_split(split="train", archive_dir=ARCHIVE_DIR, cache_dir=CACHE_DIR, mmap=True):
+    """
+    (images, labels) d'un split, relus depuis le cache .npy (projeté en
+    mémoire si mmap) quand il est à jour, sinon reconstruits avec
+    build_split puis mis en cache.
+    """
+    images_dir, labels_csv = _split_paths(split, archive_dir)
+    images_path = os.path.join(cache_dir, f"{split}_images.npy")
+    labels_path = os.path.join(cache_dir, f"{split}_labels.npy")
+    meta_path = os.path.join(cache_dir, f"{split}.json")
+    stamp = _stamp(images_dir, labels_csv)
+
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            if json.load(f) == stamp:
+                return (np.load(images_path, mmap_mode='r' if mmap else None),
+                        np.load(labels_path))
+    except (OSError, ValueError):
+        pass
+
+    images, labels = build_split(split, archive_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(images_path, images)
+        np.save(labels_path, labels)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(stamp, f)
+    except OSError:
+        pass  # dossier en lecture seule : on se passe du cache
+    return images, labels
+
+
+class HandwrittenGlyphs:
+    """
+    Source de lettres manuscrites réelles pour le générateur : un tirage
+    aléatoire parmi les exemplaires de chaque lettre (formes isolées).
+    """
+
+    def __init__(self, split="train", archive_dir=ARCHIVE_DIR, cache_dir=CACHE_DIR):
+        self.split, self.archive_dir, self.cache_dir = split, archive_dir, cache_dir
+        self._load()
+
+    def _load(self):
+        self.images, labels = load_split(self.split, self.archive_dir, self.cache_dir)
+        self.by_letter = {letter: np.flatnonzero(labels == k) for k, letter in enumerate(LETTERS, 1)}
+
+    # Les processus de génération rechargent le cache (projeté) au lieu de
+    # recevoir une copie des images
+    def __getstate__(self):
+        return {'split': self.split, 'archive_dir': self.archive_dir, 'cache_dir': self.cache_dir}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load()
+
+    def supports(self, word):
+        return bool(word) and all(c in self.by_letter for c in word)
+
+    def sample(self, letter, rng):
+        """Un exemplaire (32, 32) de la lettre ; `rng` : module random ou random.Random."""
+        indices = self.by_letter[letter]
+        return self.images[indices[rng.randrange(len(indices))]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construit le cache NumPy des caractères manuscrits arabes (archive/)")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+    for split in SPLITS:
+        start = time.perf_counter()
+        images, labels = load_split(split, args.archive_dir, args.cache_dir)
+        print(f"✅ {split}: {images.shape} images, {len(np.unique(labels))} lettres "
+              f"({(time.perf_counter() - start) * 1000:.1f} ms)")
@@ -1,6 +1,12 @@
 import os
+import argparse
+from functools import partial
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import cv2
-from preprocessor import preprocess
+import numpy as np
+from preprocessor import preprocess_batch, minmax_batch
+from shards import ShardReader
 
 # === PARAMÈTRES ===
 IMAGE_WIDTH = 128
@@ -13,71 +19,201 @@ labels_dir = "arabic_data_generator/labels"
 output_bin_path = "binary_dataset/my_dataset.bin"
 output_txt_path = "binary_dataset/my_dataset.txt"
 
-os.makedirs("binary_dataset", exist_ok=True)
 
-# === TRAITEMENT ===
-with open(output_bin_path, "wb") as bin_f, open(output_txt_path, "w", encoding="utf-8") as txt_f:
-    index = 0
-    byte_offset = 0
-    
-    for image_filename in sorted(os.listdir(images_dir)):
-        if not image_filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            continue
-        
+def encode_images(imgs):
+    """
+    Liste d'images en niveaux de gris -> tableau uint8 (B, 32, 128) prêt pour
+    le .bin : prétraitement, normalisation min-max de chaque image, puis
+    transposition pour que l'extracteur les lise correctement.
+    """
+    batch = minmax_batch(preprocess_batch(imgs, image_width=IMAGE_WIDTH, image_height=IMAGE_HEIGHT,
+                                          dtype=np.float64))
+    return np.ascontiguousarray(batch.transpose(0, 2, 1))
+
+
+class BinaryDatasetWriter:
+    """Écrit les images encodées dans le .bin et leur index dans le .txt."""
+
+    def __init__(self, bin_path=output_bin_path, txt_path=output_txt_path):
+        os.makedirs(os.path.dirname(bin_path) or ".", exist_ok=True)
+        os.makedirs(os.path.dirname(txt_path) or ".", exist_ok=True)
+        self.bin_f = open(bin_path, "wb")
+        self.txt_f = open(txt_path, "w", encoding="utf-8")
+        self.index = 0
+        self.byte_offset = 0
+
+    def write(self, img, word):
+        """Ajoute une image encodée (voir encode_images) et son mot."""
+        h, w = img.shape  # h=32, w=128
+        img_bytes = img.tobytes()
+
+        # Écriture dans le .bin
+        self.bin_f.write(img_bytes)
+
+        # Écriture dans le .txt (h=32, w=128)
+        self.txt_f.write(
+            f"image idx:{self.index};start position:{self.byte_offset};"
+            f"image height:{h};image width:{w};"
+            f"font name:Custom;font size:26;"
+            f"bold:false;italic:false;word:{word}\n"
+        )
+
+        self.index += 1
+        self.byte_offset += len(img_bytes)
+
+    def close(self):
+        self.bin_f.close()
+        self.txt_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_valid_label(word):
+    return bool(word) and len(word) <= MAX_TEXT_LENGTH
+
+
+# Raisons d'exclusion rapportées dans le résumé
+SKIP_REASONS = {
+    'missing_label': "No label",
+    'unreadable': "Could not read image",
+    'invalid_label': "Invalid or too long label",
+}
+
+
+def report(writer, skipped, total, bin_path, txt_path):
+    """
+    Affiche le résumé d'une conversion (images écrites, fichiers exclus par
+    raison) et retourne ses compteurs.
+    """
+    print(f"✅ Done: wrote {writer.index} images to {bin_path} and labels to {txt_path}")
+    for reason, names in skipped.items():
+        preview = ", ".join(names[:5]) + (", ..." if len(names) > 5 else "")
+        print(f"⚠️ {SKIP_REASONS[reason]}: {len(names)} skipped ({preview})")
+
+    summary = {'written': writer.index, 'total': total}
+    summary.update({reason: len(skipped.get(reason, ())) for reason in SKIP_REASONS})
+    return summary
+
+
+def process_chunk(filenames, images_dir=images_dir, labels_dir=labels_dir):
+    """Lit les fichiers d'un bloc puis les prétraite en un seul lot."""
+    results, imgs = [], []
+    for image_filename in filenames:
         base = os.path.splitext(image_filename)[0]
         image_path = os.path.join(images_dir, image_filename)
         label_path = os.path.join(labels_dir, base + ".txt")
-        
+
         if not os.path.isfile(label_path):
-            print(f"⚠️ No label for {image_filename}, skipping.")
+            results.append((None, None, 'missing_label'))
             continue
-        
+
         # Lire image
         img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
         if img is None:
-            print(f"⚠️ Could not read {image_path}")
+            results.append((None, None, 'unreadable'))
             continue
-        
-        # Prétraitement
-        img = preprocess(img, image_width=IMAGE_WIDTH, image_height=IMAGE_HEIGHT)
-        
-        # Normalisation sécurisée
-        if img.max() != img.min():
-            img = ((img - img.min()) * (255.0 / (img.max() - img.min()))).astype('uint8')
-        else:
-            img = img.astype('uint8')
-        
-        # preprocess retourne (128, 32)
-        if img.shape != (128, 32):
-            print(f"⚠️ Unexpected image size: {image_filename} got {img.shape}")
-            continue
-        
-        # TRANSPOSER pour que l'extracteur la lise correctement
-        img = cv2.transpose(img)  # Maintenant (32, 128)
-        
-        h, w = img.shape  # h=32, w=128
-        img_bytes = img.tobytes()
-        
+
         # Lire le label
         with open(label_path, 'r', encoding='utf-8') as f:
             word = f.read().strip()
-        
-        if not word or len(word) > MAX_TEXT_LENGTH:
-            print(f"⚠️ Invalid or too long label for {image_filename}: '{word}'")
+
+        if not is_valid_label(word):
+            results.append((None, None, 'invalid_label'))
             continue
-        
-        # Écriture dans le .bin
-        bin_f.write(img_bytes)
-        
-        # Écriture dans le .txt (h=32, w=128)
-        txt_f.write(
-            f"image idx:{index};start position:{byte_offset};"
-            f"image height:{h};image width:{w};"
-            f"font name:Custom;font size:26;"
-            f"bold:false;italic:false;word:{word}\n"
-        )
-        
-        index += 1
-        byte_offset += len(img_bytes)
 
-print(f"✅ Done: wrote {index} images to {output_bin_path} and labels to {output_txt_path}")
\ No newline at end of file
+        results.append((len(imgs), word, None))
+        imgs.append(img)
+
+    encoded = encode_images(imgs)
+    return [(encoded[i], word, None) if reason is None else (None, None, reason)
+            for i, word, reason in results]
+
+
+def convert(images_dir=images_dir, labels_dir=labels_dir,
+            bin_path=output_bin_path, txt_path=output_txt_path,
+            workers=1, chunk_size=512):
+    """
+    Convertit un dossier images/ + labels/ en .bin + .txt.
+    Avec workers > 1, les images sont décodées et prétraitées par blocs dans
+    un pool de processus ; un seul écrivain conserve l'ordre des fichiers et
+    calcule les positions de départ. Retourne les compteurs du résumé.
+    """
+    filenames = [f for f in sorted(os.listdir(images_dir))
+                 if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    chunks = [filenames[i:i + chunk_size] for i in range(0, len(filenames), chunk_size)]
+    worker = partial(process_chunk, images_dir=images_dir, labels_dir=labels_dir)
+    skipped = defaultdict(list)
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    results = executor.map(worker, chunks) if executor else map(worker, chunks)
+    try:
+        with BinaryDatasetWriter(bin_path, txt_path) as writer:
+            for chunk, chunk_results in zip(chunks, results):
+                for image_filename, (img, word, reason) in zip(chunk, chunk_results):
+                    if reason is not None:
+                        skipped[reason].append(image_filename)
+                        continue
+                    writer.write(img, word)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return report(writer, skipped, len(filenames), bin_path, txt_path)
+
+
+def convert_shards(shard_source, bin_path=output_bin_path, txt_path=output_txt_path, chunk_size=512):
+    """
+    Convertit des archives tar (shards.py) en .bin + .txt, en les lisant en
+    flux : pas de fichier intermédiaire par image. Retourne les compteurs du résumé.
+    """
+    skipped = defaultdict(list)
+    total = 0
+
+    def flush(imgs, words, writer):
+        for img, word in zip(encode_images(imgs), words):
+            writer.write(img, word)
+
+    with BinaryDatasetWriter(bin_path, txt_path) as writer:
+        imgs, words = [], []
+        for key, img, word in ShardReader(shard_source).iter_images():
+            total += 1
+            word = word.strip()
+            if img is None:
+                skipped['unreadable'].append(key)
+            elif not is_valid_label(word):
+                skipped['invalid_label'].append(key)
+            else:
+                imgs.append(img)
+                words.append(word)
+            if len(imgs) == chunk_size:
+                flush(imgs, words, writer)
+                imgs, words = [], []
+        flush(imgs, words, writer)
+
+    return report(writer, skipped, total, bin_path, txt_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert word images + labels to the binary OCR format")
+    parser.add_argument("--images-dir", default=images_dir)
+    parser.add_argument("--labels-dir", default=labels_dir)
+    parser.add_argument("--bin", default=output_bin_path, help="output .bin path")
+    parser.add_argument("--txt", default=output_txt_path, help="output .txt index path")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--shards", help="read tar shards (directory or glob) instead of images/labels folders")
+    args = parser.parse_args(argv)
+    if args.shards:
+        convert_shards(args.shards, args.bin, args.txt, chunk_size=args.chunk_size)
+        return
+    convert(args.images_dir, args.labels_dir, args.bin, args.txt,
+            workers=args.workers, chunk_size=args.chunk_size)
+
+
+# === TRAITEMENT ===
+if __name__ == "__main__":
+    main()
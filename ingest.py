@@ -0,0 +1,79 @@
+import os
+import csv
+import argparse
+
+import db
+from db import IMG_FOLDER
+from blobstore import STORE_DIR
+from word_segementation import segment_pages
+
+
+def ingest_rows(rows):
+    """
+    Insère des crops (lignes de manifest : page, x, y, w, h, crop, hash) dans la base.
+    Un crop dont le contenu est déjà en base (même hash, autre chemin) est un
+    doublon : il n'est pas ajouté et son fichier (un simple lien) est retiré du
+    dossier, pour qu'init_db ne le réintroduise pas.
+    Retourne (images ajoutées, doublons).
+    """
+    rows = list(rows)
+    seen = db.known_hashes({row['hash'] for row in rows if row.get('hash')})
+    fresh, duplicates = [], 0
+    for row in rows:
+        digest = row.get('hash') or None
+        if digest and seen.setdefault(digest, row['crop']) != row['crop']:
+            duplicates += 1
+            if os.path.exists(row['crop']):
+                os.remove(row['crop'])
+            continue
+        fresh.append({'path': row['crop'], 'page': row['page'],
+                      'x': int(row['x']), 'y': int(row['y']),
+                      'w': int(row['w']), 'h': int(row['h']), 'hash': digest})
+    return db.insert_images(fresh), duplicates
+
+
+def _report(inserted, duplicates):
+    print(f"✅ {inserted} nouvelles images ajoutées à {db.DB_PATH}"
+          f" ({duplicates} doublons ignorés).")
+
+
+def ingest_pages(inputs, output_dir=IMG_FOLDER, workers=None, store_dir=STORE_DIR):
+    """
+    Segmente des pages et ajoute leurs crops à la file d'annotation, en une
+    transaction, pendant que le serveur Flask tourne (WAL). Les crops sont
+    stockés une seule fois dans le magasin de blobs et liés dans output_dir.
+    Retourne le nombre d'images ajoutées.
+    """
+    db.init_schema()
+    rows = segment_pages(inputs, output_dir, workers, store_dir=store_dir)
+    inserted, duplicates = ingest_rows(rows)
+    db.release_db()
+    _report(inserted, duplicates)
+    return inserted
+
+
+def ingest_manifest(manifest_path):
+    """Ajoute à la base les crops d'un manifest.csv déjà produit par word_segementation.py."""
+    db.init_schema()
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        inserted, duplicates = ingest_rows(csv.DictReader(f))
+    db.release_db()
+    _report(inserted, duplicates)
+    return inserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segmente des pages et ajoute les mots à la base d'annotation")
+    parser.add_argument("pages", nargs="*", help="pages, dossiers ou motifs glob à segmenter")
+    parser.add_argument("-o", "--output-dir", default=IMG_FOLDER)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--store", default=STORE_DIR, help="magasin de blobs ('' pour le désactiver)")
+    parser.add_argument("--manifest", help="ingérer un manifest.csv existant au lieu de segmenter")
+    parser.add_argument("--db", default=db.DB_PATH)
+    args = parser.parse_args()
+
+    db.DB_PATH = args.db
+    if args.manifest:
+        ingest_manifest(args.manifest)
+    else:
+        ingest_pages(args.pages, args.output_dir, args.workers, args.store)
@@ -0,0 +1,258 @@
+import os
+import time
+import bisect
+import cProfile
+import threading
+import itertools
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+RECENT_WINDOW = 1000  # dernières requêtes par endpoint pour les quantiles glissants
+QUANTILES = (0.5, 0.9, 0.99)
+# Dossier des profils cProfile (un .prof par requête) ; None = désactivé
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or None
+
+_lock = threading.Lock()
+_local = threading.local()
+_profile_ids = itertools.count()
+
+
+class Histogram:
+    """Histogramme cumulatif au format Prometheus (buckets, somme, nombre)."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# --- REGISTRE ---
+_requests = Counter()        # (endpoint, méthode, statut) -> nombre
+_latency = {}                # endpoint -> Histogram
+_recent = {}                 # endpoint -> deque des dernières latences
+_phases = {}                 # (endpoint, phase) -> Histogram
+_queries = {}                # endpoint -> Histogram des requêtes SQL par requête HTTP
+_sql = {'queries': 0, 'seconds': 0.0}
+
+
+def _histogram(table, key, buckets):
+    hist = table.get(key)
+    if hist is None:
+        hist = table[key] = Histogram(buckets)
+    return hist
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.queries = 0
+        self.total = 0.0
+
+
+def current():
+    """Statistiques de la requête HTTP en cours dans ce thread (ou None)."""
+    return getattr(_local, 'stats', None)
+
+
+def begin_request():
+    _local.stats = RequestStats()
+
+
+def end_request(endpoint, method, status):
+    """Clôt la requête en cours et l'ajoute au registre ; retourne ses statistiques."""
+    stats = current()
+    if stats is None:
+        return None
+    _local.stats = None
+    stats.total = time.perf_counter() - stats.start
+    with _lock:
+        _requests[endpoint, method, str(status)] += 1
+        _histogram(_latency, endpoint, LATENCY_BUCKETS).observe(stats.total)
+        _recent.setdefault(endpoint, deque(maxlen=RECENT_WINDOW)).append(stats.total)
+        _histogram(_queries, endpoint, QUERY_BUCKETS).observe(stats.queries)
+        for name, seconds in stats.phases.items():
+            _histogram(_phases, (endpoint, name), LATENCY_BUCKETS).observe(seconds)
+    return stats
+
+
+def add_phase(name, seconds):
+    """
+    Ajoute du temps à une phase (db, export, render...) : cumulé sur la
+    requête en cours, ou observé directement hors requête (threads de fond).
+    """
+    stats = current()
+    if stats is not None:
+        stats.phases[name] += seconds
+    else:
+        with _lock:
+            _histogram(_phases, ('background', name), LATENCY_BUCKETS).observe(seconds)
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - start)
+
+
+def record_query(seconds, count=1):
+    """Appelé par la couche SQLite (db.py) pour chaque requête exécutée."""
+    with _lock:
+        _sql['queries'] += count
+        _sql['seconds'] += seconds
+    stats = current()
+    if stats is not None:
+        stats.queries += count
+        stats.phases['db'] += seconds
+
+
+def record_db_time(seconds):
+    """Temps passé à lire les résultats (fetch), sans compter de requête."""
+    with _lock:
+        _sql['seconds'] += seconds
+    stats = current()
+    if stats is not None:
+        stats.phases['db'] += seconds
+
+
+# --- EXPOSITION PROMETHEUS ---
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _render_histogram(lines, name, hist, **labels):
+    cumulative = 0
+    for bound, count in zip(list(hist.buckets) + ['+Inf'], hist.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_sum{_labels(**labels)} {hist.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {hist.count}")
+
+
+def render_prometheus():
+    """Toutes les métriques au format texte d'exposition Prometheus."""
+    lines = []
+    with _lock:
+        lines += ["# HELP annotation_http_requests_total Requêtes HTTP traitées.",
+                  "# TYPE annotation_http_requests_total counter"]
+        for (endpoint, method, status), n in sorted(_requests.items()):
+            lines.append(f"annotation_http_requests_total"
+                         f"{_labels(endpoint=endpoint, method=method, status=status)} {n}")
+
+        lines += ["# HELP annotation_http_request_duration_seconds Durée des requêtes HTTP.",
+                  "# TYPE annotation_http_request_duration_seconds histogram"]
+        for endpoint, hist in sorted(_latency.items()):
+            _render_histogram(lines, "annotation_http_request_duration_seconds", hist, endpoint=endpoint)
+
+        lines += [f"# HELP annotation_http_request_recent_seconds Quantiles des {RECENT_WINDOW} "
+                  f"dernières requêtes par endpoint.",
+                  "# TYPE annotation_http_request_recent_seconds summary"]
+        for endpoint, window in sorted(_recent.items()):
+            values = sorted(window)
+            for q in QUANTILES:
+                value = values[min(len(values) - 1, int(q * len(values)))]
+                lines.append(f"annotation_http_request_recent_seconds"
+                             f"{_labels(endpoint=endpoint, quantile=q)} {value}")
+            lines.append(f"annotation_http_request_recent_seconds_sum{_labels(endpoint=endpoint)} {sum(values)}")
+            lines.append(f"annotation_http_request_recent_seconds_count{_labels(endpoint=endpoint)} {len(values)}")
+
+        lines += ["# HELP annotation_phase_duration_seconds Temps par phase (db, export, render) "
+                  "et par requête ; endpoint=\"background\" hors requête.",
+                  "# TYPE annotation_phase_duration_seconds histogram"]
+        for (endpoint, name), hist in sorted(_phases.items()):
+            _render_histogram(lines, "annotation_phase_duration_seconds", hist, endpoint=endpoint, phase=name)
+
+        lines += ["# HELP annotation_sql_queries_per_request Requêtes SQL par requête HTTP.",
+                  "# TYPE annotation_sql_queries_per_request histogram"]
+        for endpoint, hist in sorted(_queries.items()):
+            _render_histogram(lines, "annotation_sql_queries_per_request", hist, endpoint=endpoint)
+
+        lines += ["# HELP annotation_sql_queries_total Requêtes SQL exécutées.",
+                  "# TYPE annotation_sql_queries_total counter",
+                  f"annotation_sql_queries_total {_sql['queries']}",
+                  "# HELP annotation_sql_seconds_total Temps passé dans SQLite.",
+                  "# TYPE annotation_sql_seconds_total counter",
+                  f"annotation_sql_seconds_total {_sql['seconds']}"]
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Vide le registre (tests, benchmarks)."""
+    with _lock:
+        for table in (_requests, _latency, _recent, _phases, _queries):
+            table.clear()
+        _sql.update(queries=0, seconds=0.0)
+
+
+# --- INTÉGRATION FLASK ---
+def init_app(app):
+    """
+    Instrumente une application Flask : durée et requêtes SQL de chaque
+    requête, temps de rendu des templates, en-têtes Server-Timing /
+    X-SQL-Queries, route /metrics, et profil cProfile par requête si
+    PROFILE_DIR est défini.
+    """
+    from flask import request, Response, before_render_template, template_rendered
+
+    @app.before_request
+    def _begin():
+        begin_request()
+        if PROFILE_DIR:
+            _local.profiler = cProfile.Profile()
+            _local.profiler.enable()
+
+    def _finish(status, response=None):
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _local.profiler = None
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(
+                PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{next(_profile_ids):06d}-"
+                             f"{request.endpoint or 'unknown'}.prof"))
+        stats = end_request(request.endpoint or 'unknown', request.method, status)
+        if response is not None and stats is not None:
+            timings = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in stats.phases.items()]
+            response.headers['Server-Timing'] = ', '.join(timings + [f"total;dur={stats.total * 1000:.2f}"])
+            response.headers['X-SQL-Queries'] = str(stats.queries)
+
+    @app.after_request
+    def _after(response):
+        _finish(response.status_code, response)
+        return response
+
+    # Requête interrompue par une exception : after_request n'est pas appelé
+    @app.teardown_request
+    def _teardown(exc):
+        if current() is not None:
+            _finish(500)
+
+    def _render_start(sender, template, context, **extra):
+        _local.render_start = time.perf_counter()
+
+    def _render_end(sender, template, context, **extra):
+        start = getattr(_local, 'render_start', None)
+        if start is not None:
+            add_phase('render', time.perf_counter() - start)
+            _local.render_start = None
+
+    before_render_template.connect(_render_start, app, weak=False)
+    template_rendered.connect(_render_end, app, weak=False)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
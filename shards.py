@@ -0,0 +1,134 @@
+import io
+import os
+import glob
+import gzip
+import tarfile
+import cv2
+import numpy as np
+
+SAMPLES_PER_SHARD = 10000
+COMPRESSIONS = (None, "gz", "bz2", "xz")
+SHARD_PATTERN = "shard-*.tar*"
+
+
+class ShardWriter:
+    """
+    Writes (key, image, label) samples into tar shards of `samples_per_shard`
+    samples: <out_dir>/shard-000000.tar[.gz|.bz2|.xz], each sample stored as
+    <key>.png + <key>.txt. Every shard gets a <shard>.idx file listing
+    key, offset and size of the image in the (uncompressed) tar, and label.
+    Member metadata is fixed, so the same samples give byte-identical shards.
+    """
+
+    def __init__(self, out_dir, samples_per_shard=SAMPLES_PER_SHARD, compression=None, prefix="shard"):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression {compression!r}, expected one of {COMPRESSIONS}")
+        if samples_per_shard < 1:
+            raise ValueError("samples_per_shard must be at least 1")
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.samples_per_shard = samples_per_shard
+        self.compression = compression
+        self.prefix = prefix
+        self.shards = []
+        self.count = 0
+        self.tar = None
+
+    def _open(self):
+        name = f"{self.prefix}-{len(self.shards):06d}.tar" + (f".{self.compression}" if self.compression else "")
+        path = os.path.join(self.out_dir, name)
+        # gzip stores a timestamp in its header: pin it for reproducible shards
+        self.fileobj = gzip.GzipFile(path, "wb", mtime=0) if self.compression == "gz" else None
+        mode = f"w:{self.compression}" if self.compression and not self.fileobj else "w"
+        self.tar = tarfile.open(path, mode, fileobj=self.fileobj, format=tarfile.USTAR_FORMAT)
+        self.shards.append(path)
+        self.index = []
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        self.tar.addfile(info, io.BytesIO(data))
+        # The data block ends at the current offset, padded to 512 bytes
+        return self.tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def write(self, key, image, label):
+        """Add one sample: `image` is encoded image bytes (PNG) or a uint8 array."""
+        if self.tar is None:
+            self._open()
+        if isinstance(image, np.ndarray):
+            image = cv2.imencode(".png", image)[1].tobytes()
+        offset = self._add(f"{key}.png", image)
+        self._add(f"{key}.txt", label.encode("utf-8"))
+        self.index.append(f"{key}\t{offset}\t{len(image)}\t{label}\n")
+        self.count += 1
+        if len(self.index) == self.samples_per_shard:
+            self._close_shard()
+
+    def _close_shard(self):
+        self.tar.close()
+        if self.fileobj is not None:
+            self.fileobj.close()
+        with open(self.shards[-1] + ".idx", "w", encoding="utf-8") as f:
+            f.writelines(self.index)
+        self.tar = None
+
+    def close(self):
+        if self.tar is not None:
+            self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def shard_paths(source):
+    """Shard files from a directory, a glob pattern or a list of paths, in order."""
+    if isinstance(source, (list, tuple)):
+        return list(source)
+    if os.path.isdir(source):
+        source = os.path.join(source, SHARD_PATTERN)
+    return sorted(p for p in glob.glob(source) if not p.endswith(".idx"))
+
+
+def read_index(shard_path):
+    """Index of a shard: list of (key, image offset, image size, label)."""
+    entries = []
+    with open(shard_path + ".idx", encoding="utf-8") as f:
+        for line in f:
+            key, offset, size, label = line.rstrip("\n").split("\t", 3)
+            entries.append((key, int(offset), int(size), label))
+    return entries
+
+
+class ShardReader:
+    """
+    Streaming reader of ShardWriter output: shards are read sequentially
+    (tar stream mode, any compression), one sample at a time.
+    """
+
+    def __init__(self, source):
+        self.paths = shard_paths(source)
+
+    def __len__(self):
+        return sum(len(read_index(path)) for path in self.paths)
+
+    def __iter__(self):
+        """Yields (key, PNG bytes, label)."""
+        for path in self.paths:
+            with tarfile.open(path, "r|*") as tar:
+                pending = {}
+                for member in tar:
+                    key, ext = member.name.rsplit(".", 1)
+                    pending.setdefault(key, {})[ext] = tar.extractfile(member).read()
+                    sample = pending[key]
+                    if "png" in sample and "txt" in sample:
+                        del pending[key]
+                        yield key, sample["png"], sample["txt"].decode("utf-8")
+
+    def iter_images(self, flags=cv2.IMREAD_GRAYSCALE):
+        """Yields (key, decoded image, label)."""
+        for key, data, label in self:
+            yield key, cv2.imdecode(np.frombuffer(data, np.uint8), flags), label
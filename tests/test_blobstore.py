@@ -0,0 +1,26 @@
+import os
+
+from blobstore import BlobStore, link_or_copy
+
+
+def test_link_same_pair_twice_leaves_no_temp_file(tmp_path):
+    src = tmp_path / "src.png"
+    src.write_bytes(b"png")
+    dest = tmp_path / "out" / "word.png"
+
+    link_or_copy(str(src), str(dest))
+    link_or_copy(str(src), str(dest))
+
+    assert os.listdir(tmp_path / "out") == ["word.png"]
+    assert os.path.samefile(src, dest)
+
+
+def test_put_and_link_twice_leaves_no_temp_file(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    dest = tmp_path / "images" / "word.png"
+
+    digest, is_new = store.put_and_link(b"png", str(dest))
+    assert is_new
+    assert store.put_and_link(b"png", str(dest)) == (digest, False)
+
+    assert os.listdir(tmp_path / "images") == ["word.png"]
@@ -0,0 +1,88 @@
+import os
+import hashlib
+import tempfile
+import threading
+from functools import lru_cache
+import cv2
+
+# === PARAMÈTRES ===
+CACHE_DIR = "cache/thumbnails"
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+FORMATS = {
+    'webp': ('.webp', 'image/webp', [cv2.IMWRITE_WEBP_QUALITY, 90]),
+    'jpeg': ('.jpg', 'image/jpeg', [cv2.IMWRITE_JPEG_QUALITY, 90]),
+    'png': ('.png', 'image/png', [cv2.IMWRITE_PNG_COMPRESSION, 9]),
+}
+
+
+@lru_cache(maxsize=65536)
+def _file_digest(path, size, mtime_ns):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def file_digest(path):
+    """sha256 du fichier, recalculé seulement si sa taille ou sa date changent."""
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+class ThumbnailCache:
+    """
+    Variantes redimensionnées / réencodées des images, gardées sur disque
+    (<root>/<hash>-h<hauteur>.<ext>) et évincées par ordre d'utilisation
+    (LRU, date de modification rafraîchie à chaque accès) au-delà de max_bytes.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(root) if entry.is_file())
+
+    def get(self, src_path, digest, height=None, fmt='webp'):
+        """Chemin de la variante (créée au besoin) ; `height` ne fait que réduire."""
+        ext, _, params = FORMATS[fmt]
+        path = os.path.join(self.root, f"{digest}-h{height or 0}{ext}")
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        img = cv2.imread(src_path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError(f"image illisible : {src_path}")
+        if height and img.shape[0] > height:
+            width = max(1, round(img.shape[1] * height / img.shape[0]))
+            img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        data = cv2.imencode(ext, img, params)[1].tobytes()
+
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _evict(self, keep):
+        """Supprime les variantes les moins récemment utilisées jusqu'à 90 % de max_bytes."""
+        entries = sorted((entry for entry in os.scandir(self.root)
+                          if entry.is_file() and not entry.name.startswith('.')),
+                         key=lambda entry: entry.stat().st_mtime_ns)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            if entry.path == keep:
+                continue
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.size -= size
+            except FileNotFoundError:
+                pass